@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the calcium model.
+
+    python benchmark.py scaling --grid-size 4096 --threads 1,2,4,8,16,32
+
+measures how the tiled fused step scales with the number of threads and
+checks that every thread count gives the same state as the single-threaded run
+(--ndim 3 --grid-size 256 does the same for a 256**3 volume split into slabs).
+
+    python benchmark.py precision --grid-size 1000 --steps 2000
+
+runs the standard test protocols in float32 and float64 and reports the
+float32 error against the float64 reference together with the speedup.
+
+    python benchmark.py suite --history benchmark_history.jsonl --baseline baseline.json
+
+times the hot paths (step() at several grid sizes, geometry generation, local
+IP3 uncaging, parameter save/load and an offscreen GUI redraw). It reports
+calls/s, cell updates/s and peak traced memory, appends the results to a
+JSON-lines history, and flags cases that are slower than the stored baseline.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import geometry
+from calcium_model import CalciumModel
+
+
+def time_steps(model, steps):
+    """Wall time per step, after one warm-up step"""
+    model.step()
+    start = time.perf_counter()
+    for _ in range(steps):
+        model.step()
+    return (time.perf_counter() - start) / steps
+
+
+def bench_scaling(grid_size, thread_counts, steps, seed=0, ndim=2):
+    """Time the fused step for each thread count; return one record per count"""
+    results = []
+    reference = None
+    for threads in thread_counts:
+        model = CalciumModel(grid_size=grid_size, backend="fused", threads=threads, seed=seed, ndim=ndim)
+        seconds = time_steps(model, steps)
+        state = np.stack([getattr(model, name) for name in model.state_fields])
+        if reference is None:
+            reference = (seconds, state)
+        results.append({
+            'threads': threads,
+            'seconds_per_step': seconds,
+            'speedup': reference[0] / seconds,
+            'identical': bool(np.array_equal(state, reference[1])),
+        })
+    return results
+
+
+# Standard test protocols: each prepares a freshly built model
+def _rest(model):
+    pass
+
+
+def _global_ip3(model):
+    model.add_ip3_global(2.0, model.dt)
+
+
+def _local_ip3(model):
+    centre = model.grid_size // 2
+    model.add_ip3_local(centre, centre, model.grid_size // 20, 5.0, model.dt)
+
+
+def _release(model):
+    # Raised Ca2+ without buffering, so IP3R clusters open and release
+    model.calcium[...] = 0.3
+    model.add_ip3_global(3.0, model.dt)
+
+
+# The protocols use the implicit diffusion solver and a subcycled buffer, so
+# that the float64 reference is itself stable (the explicit defaults are not
+# at dt=0.001) and the comparison measures rounding rather than instability
+STABLE = {'diffusion': 'implicit', 'buffer_substeps': 20}
+
+PROTOCOLS = {
+    'rest': (STABLE, _rest),
+    'global_ip3': (STABLE, _global_ip3),
+    'local_ip3': (STABLE, _local_ip3),
+    'release': (dict(STABLE, ip3r_open_rate=50, buffer_total=0), _release),
+}
+
+
+def bench_precision(grid_size, steps, backend="fused", seed=0, protocols=PROTOCOLS):
+    """Run each protocol in float64 and float32; return one record per protocol and field.
+
+    Both runs use the same seed, so the channel gating sees the same random
+    draws and differences come from rounding alone (plus any channel whose
+    opening probability lands within rounding of its draw).
+    """
+    results = []
+    for name, (params, prepare) in protocols.items():
+        runs = {}
+        for dtype in ('float64', 'float32'):
+            model = CalciumModel(grid_size=grid_size, backend=backend, seed=seed, dtype=dtype, **params)
+            prepare(model)
+            runs[dtype] = (model, time_steps(model, steps))
+        (reference, seconds64), (model, seconds32) = runs['float64'], runs['float32']
+        for field in model.state_fields:
+            ref = getattr(reference, field)
+            diff = getattr(model, field).astype(np.float64) - ref
+            scale = np.abs(ref).max() or 1.0
+            results.append({
+                'protocol': name,
+                'field': field,
+                'max_rel_error': float(np.abs(diff).max() / scale),
+                'rms_rel_error': float(np.sqrt(np.mean(diff**2)) / scale),
+                'open_ip3r_64': int(reference.ip3r_open.sum()),
+                'open_ip3r_32': int(model.ip3r_open.sum()),
+                'speedup': seconds64 / seconds32,
+            })
+    return results
+
+
+def measure(run, repeats, cells=None):
+    """Time run() (median of `repeats` calls after a warm-up) and trace its peak memory"""
+    run()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    seconds = float(np.median(times))
+
+    # Tracing slows the call down, so the peak is taken from a separate call
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result = {'seconds': seconds, 'calls_per_s': 1 / seconds, 'peak_bytes': peak}
+    if cells is not None:
+        result['cell_updates_per_s'] = cells / seconds
+    return result
+
+
+def suite_cases(grid_sizes, backend="numpy", gui=True):
+    """(name, run, repeats, cells) for every case of the benchmark suite"""
+    cases = []
+    for grid_size in grid_sizes:
+        model = CalciumModel(grid_size=grid_size, backend=backend, seed=0)
+        repeats = max(3, min(50, 4 * 10**7 // grid_size**2))
+        cases.append((f"step_{grid_size}", model.step, repeats, grid_size**2))
+
+    model = CalciumModel(seed=0)
+
+    def create_cell_structure():
+        geometry.clear_cache()
+        model.create_cell_structure()
+    cases.append(("create_cell_structure", create_cell_structure, 10, None))
+    cases.append(("create_cell_structure_cached", model.create_cell_structure, 50, None))
+
+    centre = model.grid_size // 2
+
+    def add_ip3_local():
+        model.clear_stimuli()
+        model.add_ip3_local(centre, centre, 10, 1.0, 1.0)
+        model._apply_stimuli(model.dt)
+    cases.append(("add_ip3_local", add_ip3_local, 50, None))
+
+    filename = os.path.join(tempfile.mkdtemp(), 'parameters.json')
+
+    def save_load_parameters():
+        model.save_parameters(filename)
+        model.load_parameters(filename)
+    cases.append(("save_load_parameters", save_load_parameters, 10, None))
+
+    if gui:
+        window = _offscreen_window(model)
+        if window is not None:
+            frame = window.runner.capture()
+            cases.append(("update_view", lambda: window.update_view(frame), 20, None))
+    return cases
+
+
+def _offscreen_window(model):
+    # A MainWindow rendering to an offscreen platform, or None without PyQt
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PyQt5.QtWidgets import QApplication
+        from gui import MainWindow
+    except ImportError:
+        return None
+    app = QApplication.instance() or QApplication([])
+    # The window writes its default cell state files into the working directory
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        window = MainWindow(model)
+    finally:
+        os.chdir(cwd)
+    window.show_ip3r.setChecked(True)
+    window._app = app
+    return window
+
+
+def run_suite(grid_sizes, backend="numpy", gui=True):
+    """Run the benchmark suite; return {case name: result}"""
+    results = {}
+    for name, run, repeats, cells in suite_cases(grid_sizes, backend, gui):
+        results[name] = measure(run, repeats, cells)
+    return results
+
+
+def environment():
+    """Description of the machine and code version the results were taken on"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'host': platform.node(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Cases that are more than `tolerance` (a fraction) slower than the baseline"""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is not None and result['seconds'] > reference['seconds'] * (1 + tolerance):
+            regressions.append((name, result['seconds'] / reference['seconds']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calcium model benchmarks.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    scaling = subparsers.add_parser('scaling', help="thread scaling of the tiled fused step")
+    scaling.add_argument('--grid-size', type=int, default=1000)
+    scaling.add_argument('--threads', default='1,2,4,8', help="comma-separated thread counts")
+    scaling.add_argument('--steps', type=int, default=10)
+    scaling.add_argument('--ndim', type=int, choices=(2, 3), default=2,
+                         help="2D sheet or 3D volume with grid-size cells per side")
+
+    precision = subparsers.add_parser('precision', help="float32 accuracy and speed against float64")
+    precision.add_argument('--grid-size', type=int, default=500)
+    precision.add_argument('--steps', type=int, default=1000)
+    precision.add_argument('--backend', choices=('numpy', 'fused'), default='fused')
+
+    suite = subparsers.add_parser('suite', help="hot path benchmarks with history and regression check")
+    suite.add_argument('--grid-sizes', default='200,1000,4000', help="comma-separated grid sizes for step()")
+    suite.add_argument('--backend', choices=('numpy', 'fused'), default='numpy')
+    suite.add_argument('--no-gui', action='store_true', help="skip the offscreen GUI benchmark")
+    suite.add_argument('--history', default='benchmark_history.jsonl', help="JSON-lines file the run is appended to")
+    suite.add_argument('--baseline', help="baseline results to check for regressions")
+    suite.add_argument('--save-baseline', action='store_true', help="store this run as the new baseline")
+    suite.add_argument('--tolerance', type=float, default=0.1, help="allowed slowdown before flagging (fraction)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'scaling':
+        thread_counts = [int(n) for n in args.threads.split(',')]
+        print(f"{'threads':>8} {'s/step':>10} {'speedup':>8} {'identical':>10}")
+        for result in bench_scaling(args.grid_size, thread_counts, args.steps, ndim=args.ndim):
+            print(f"{result['threads']:>8} {result['seconds_per_step']:>10.4f} "
+                  f"{result['speedup']:>8.2f} {str(result['identical']):>10}")
+    elif args.command == 'precision':
+        print(f"{'protocol':>12} {'field':>14} {'max rel err':>12} {'rms rel err':>12} {'open 64/32':>11} {'speedup':>8}")
+        for result in bench_precision(args.grid_size, args.steps, args.backend):
+            open_counts = f"{result['open_ip3r_64']}/{result['open_ip3r_32']}"
+            print(f"{result['protocol']:>12} {result['field']:>14} {result['max_rel_error']:>12.2e} "
+                  f"{result['rms_rel_error']:>12.2e} {open_counts:>11} {result['speedup']:>8.2f}")
+    elif args.command == 'suite':
+        grid_sizes = [int(n) for n in args.grid_sizes.split(',')]
+        results = run_suite(grid_sizes, args.backend, not args.no_gui)
+        print(f"{'case':>30} {'s/call':>10} {'calls/s':>10} {'cells/s':>10} {'peak MB':>8}")
+        for name, result in results.items():
+            cells = result.get('cell_updates_per_s')
+            cells = f"{cells:>10.3g}" if cells is not None else f"{'':>10}"
+            print(f"{name:>30} {result['seconds']:>10.4g} {result['calls_per_s']:>10.3g} {cells} "
+                  f"{result['peak_bytes'] / 2**20:>8.1f}")
+
+        record = {'environment': environment(), 'backend': args.backend, 'results': results}
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+        if args.baseline and args.save_baseline:
+            with open(args.baseline, 'w') as f:
+                json.dump(record, f, indent=2)
+            print(f"Saved baseline to {args.baseline}")
+        elif args.baseline:
+            with open(args.baseline, 'r') as f:
+                baseline = json.load(f)
+            regressions = compare(results, baseline['results'], args.tolerance)
+            for name, ratio in regressions:
+                print(f"REGRESSION: {name} is {ratio:.2f}x slower than the baseline")
+            if regressions:
+                return 1
+            print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+import numpy as np
+from calcium_model import CalciumModel
+
+
+class CalciumEnsemble(CalciumModel):
+    """Independent replicates of a CalciumModel advanced together.
+
+    Every state array carries a leading replicate axis, so one call to step()
+    advances all replicates, including the stochastic IP3R draws and the
+    diffusion convolution. Rate constants, concentrations and other physical
+    parameters may be given either as a scalar shared by all replicates or as
+    a sequence with one value per replicate; the parameters listed in
+    shared_parameters (grid, time stepping, substep counts, tiling and
+    refinement) take a single value.
+    With shared_geometry=False each replicate gets its own ER, mitochondria and
+    IP3R cluster layout; otherwise a single layout is broadcast over the batch.
+    """
+
+    # Parameters that fix the array shapes or the execution path, and so must
+    # be the same for every replicate
+    shared_parameters = ('grid_size', 'backend', 'seed', 'ndim',
+                         'dt', 'adaptive', 'dt_min', 'dt_max',
+                         'buffer_substeps', 'ip3_substeps', 'slow_interval',
+                         'threads', 'tiles', 'refine', 'refine_radius', 'refine_interval',
+                         'fast_forward')
+
+    def __init__(self, n_replicates, shared_geometry=True, **params):
+        self.n_replicates = n_replicates
+        self.shared_geometry = shared_geometry
+        self.dtype = np.dtype(params.get('dtype', np.float64))
+        for key, value in params.items():
+            if np.ndim(value) == 0:
+                continue
+            if key in self.shared_parameters:
+                raise ValueError(f"Parameter '{key}' must be the same for all replicates")
+            params[key] = self._per_replicate(key, value)
+        if shared_geometry:
+            for key in ('ip3r_cluster_density', 'ip3r_per_cluster', 'geometry_seed'):
+                if np.ndim(params.get(key, 0)) > 0:
+                    raise ValueError(f"Parameter '{key}' varies across replicates, "
+                                     "which requires shared_geometry=False")
+        if params.get('ndim', 2) != 2:
+            raise ValueError("CalciumEnsemble replicates 2D cells only")
+        super().__init__(**params)
+
+    def diffusion_kernel(self):
+        # Diffusion acts within each replicate only
+        return super().diffusion_kernel()[np.newaxis]
+
+    def _per_replicate(self, key, value):
+        # Seeds stay integers; rates follow the model precision
+        value = np.asarray(value, dtype=np.int64 if key == 'geometry_seed' else self.dtype)
+        if value.shape != (self.n_replicates,):
+            raise ValueError(f"Parameter '{key}' needs one value per replicate "
+                             f"({self.n_replicates}), got shape {value.shape}")
+        return value.reshape(-1, 1, 1)
+
+    def replicate_value(self, value, index):
+        """Value of a (possibly per-replicate) parameter for one replicate"""
+        if np.ndim(value) == 0:
+            return value
+        return np.broadcast_to(value, (self.n_replicates, 1, 1))[index, 0, 0].item()
+
+    def replicate_geometry_seed(self, index):
+        """Geometry seed of one replicate when the layouts are not shared.
+
+        A scalar geometry_seed gives each replicate its own layout, derived
+        from the seed and the replicate index.
+        """
+        if np.ndim(self.geometry_seed) == 0:
+            return [self.geometry_seed, index]
+        return int(self.replicate_value(self.geometry_seed, index))
+
+    def state_shape(self):
+        return (self.n_replicates, self.grid_size, self.grid_size)
+
+    def create_cell_structure(self):
+        if self.shared_geometry:
+            layouts = [self.generate_cell_structure(self.ip3r_cluster_density, self.ip3r_per_cluster,
+                                                    self.geometry_seed)]
+        else:
+            layouts = [self.generate_cell_structure(
+                           self.replicate_value(self.ip3r_cluster_density, i),
+                           self.replicate_value(self.ip3r_per_cluster, i),
+                           self.replicate_geometry_seed(i))
+                       for i in range(self.n_replicates)]
+        self.er, self.mitochondria, self.pm, self.ip3r_clusters = (
+            np.stack(parts) for parts in zip(*layouts))
+        self.index_compartments()
+        self.index_ip3r_sites()
+
+    def site_values(self, value, sites=None):
+        if np.ndim(value) == 0:
+            return value
+        sites = self.ip3r_sites if sites is None else sites
+        return np.ravel(value)[sites // (self.grid_size * self.grid_size)]
+
+    def apply_parameters(self, params, source):
+        self.dtype = np.dtype(params.get('dtype', self.dtype))
+        params = {key: self._per_replicate(key, value) if np.ndim(value) > 0 else value
+                  for key, value in params.items()}
+        super().apply_parameters(params, source)
+
+    def get_parameters(self):
+        params = super().get_parameters()
+        for key, value in params.items():
+            if np.ndim(value) > 0:
+                params[key] = np.ravel(value).tolist()
+        return params
+
+    def replicate(self, index):
+        """Return replicate `index` as a standalone CalciumModel with its current state.
+
+        The copy starts at the ensemble's time, with its pending stimuli and
+        multi-rate phase, so stepping it continues the replicate's protocol.
+        Its random stream is freshly seeded, so later IP3R draws differ from
+        the ensemble's.
+        """
+        params = {key: self.replicate_value(value, index)
+                  for key, value in CalciumModel.get_parameters(self).items()}
+        if not self.shared_geometry:
+            params['geometry_seed'] = self.replicate_geometry_seed(index)
+        model = CalciumModel(backend=self.backend, **params)
+        geometry = 0 if self.shared_geometry else index
+        model.er = self.er[geometry].copy()
+        model.mitochondria = self.mitochondria[geometry].copy()
+        model.pm = self.pm[geometry].copy()
+        model.ip3r_clusters = self.ip3r_clusters[geometry].copy()
+        for name in ('calcium', 'er_calcium', 'mito_calcium', 'ip3_conc', 'buffer_bound', 'ip3r_open'):
+            getattr(model, name)[...] = getattr(self, name)[index]
+        model.index_compartments()
+        model.index_ip3r_sites()
+        # Footprints index a single cell's grid, so stimuli carry over as they are
+        model.t = self.t
+        model.stimuli = list(self.stimuli)
+        model._dt_next = self._dt_next
+        model._slow_steps, model._slow_elapsed = self._slow_steps, self._slow_elapsed
+        return model
@@ -1,7 +1,29 @@
 import numpy as np
-from scipy.ndimage import convolve, binary_dilation
-from skimage.draw import line
+from scipy.ndimage import convolve
+from scipy.fft import dctn, idctn
+from scipy.optimize import NoConvergence, newton_krylov
+from scipy.sparse.linalg import LinearOperator
+import itertools
 import json
+import os
+import struct
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+import geometry
+import refinement
+import stimulus
+
+# Checkpoint files: magic, header length, JSON header, then the raw arrays,
+# each starting on a CHECKPOINT_ALIGN byte boundary so they can be mapped
+CHECKPOINT_MAGIC = b'CALCKPT1'
+CHECKPOINT_ALIGN = 64
+
+
+def _aligned(n):
+    return -(-n // CHECKPOINT_ALIGN) * CHECKPOINT_ALIGN
+
+
+_NO_PHASE = nullcontext()
 
 class CalciumModel:
     def __init__(self, grid_size=200, dx=0.1, dt=0.001,
@@ -11,18 +33,84 @@ class CalciumModel:
                  serca_rate=0.4, serca_k=0.2,
                  ip3_degradation_rate=0.1, pmca_rate=0.1, mcu_rate=0.05,
                  buffer_total=100, buffer_kd=0.5, buffer_kon=100,
-                 er_calcium_init=500, mito_calcium_init=0.1):
+                 er_calcium_init=500, mito_calcium_init=0.1,
+                 backend="numpy", seed=None, gating="uniform", diffusion="explicit",
+                 adaptive=False, rtol=0.01, atol=0.001, dt_min=None, dt_max=None,
+                 buffer_substeps=1, ip3_substeps=1, slow_interval=1,
+                 threads=1, tiles=None, geometry_seed=None, dtype=np.float64,
+                 refine=1, refine_radius=2, refine_gradient=None, refine_interval=10,
+                 fast_forward=False, ndim=2):
+
+        if backend not in ("numpy", "fused"):
+            raise ValueError(f"Unknown backend '{backend}', expected 'numpy' or 'fused'")
+        if gating not in ("uniform", "binomial"):
+            raise ValueError(f"Unknown gating engine '{gating}', expected 'uniform' or 'binomial'")
+        if diffusion not in ("explicit", "implicit"):
+            raise ValueError(f"Unknown diffusion solver '{diffusion}', expected 'explicit' or 'implicit'")
+        if np.dtype(dtype) not in (np.float32, np.float64):
+            raise ValueError(f"Unsupported dtype '{dtype}', expected float32 or float64")
+        if ndim not in (2, 3):
+            raise ValueError(f"Unsupported ndim {ndim}, expected 2 or 3")
+        self.backend = backend
+        # Floating point precision of the state, work buffers and kernels
+        self.dtype = np.dtype(dtype)
+        self.gating = gating
+        self.diffusion = diffusion
+        self._diffusion_factors = {}
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        # The cell layout has its own seed, so the same cell can be kept while
+        # the gating noise changes; by default it is drawn from the model seed
+        if geometry_seed is None:
+            geometry_seed = int(self.rng.integers(2**31))
+        self.geometry_seed = geometry_seed
+
+        # Thread pool for the tiled fused kernel and the transform solver
+        self.threads = threads
+        self.tiles = tiles
+        self._pool = None
+
+        # Functions called with the model after every step (recorders, monitors)
+        self.callbacks = []
+        # Optional profiling.StepProfiler timing the phases of step()
+        self.profiler = None
 
         self.grid_size = grid_size
+        # Spatial dimensions: a grid_size**2 sheet or a grid_size**3 volume
+        self.ndim = ndim
         self.dx = dx
         self.dt = dt
 
+        # Adaptive time stepping (used by advance/run_until)
+        self.adaptive = adaptive
+        self.rtol = rtol
+        self.atol = atol
+        self.dt_min = dt_min
+        self.dt_max = dt_max
+        # Jump over quiescent periods in advance() instead of stepping through them
+        self.fast_forward = fast_forward
+
+        # Multi-rate scheduling: buffer binding and IP3 diffusion are
+        # subcycled within a step, while the slow ER/mitochondrial exchange and
+        # IP3 degradation are only updated every slow_interval steps
+        self.buffer_substeps = buffer_substeps
+        self.ip3_substeps = ip3_substeps
+        self.slow_interval = slow_interval
+
+        # Adaptive refinement: fine reconstructions of the cytosolic Ca2+,
+        # refine times finer than the grid, around open IP3R clusters and
+        # steep Ca2+ gradients (diagnostic only, see refinement.py)
+        self.refine = refine
+        self.refine_radius = refine_radius
+        self.refine_gradient = refine_gradient
+        self.refine_interval = refine_interval
+
         # IP3R parameters
         self.ip3r_cluster_density = ip3r_cluster_density
         self.ip3r_per_cluster = ip3r_per_cluster
         self.ip3r_open_rate = ip3r_open_rate
         self.ip3r_close_rate = ip3r_close_rate
-        self.ip3r_open = np.zeros((self.grid_size, self.grid_size), dtype=np.int32)
+        self.ip3r_open = np.zeros((self.grid_size,) * ndim, dtype=np.int32)
 
 
         # Other parameters
@@ -43,11 +131,6 @@ class CalciumModel:
         self.er_calcium_init = er_calcium_init
         self.mito_calcium_init = mito_calcium_init
 
-        # Kernel for 2D diffusion
-        self.kernel = np.array([[0.05, 0.2, 0.05],
-                                [0.2, -1, 0.2],
-                                [0.05, 0.2, 0.05]])
-
         # Calculate equilibrium calcium concentration
         self.eq_calcium = self.calculate_equilibrium_calcium()
 
@@ -56,7 +139,8 @@ class CalciumModel:
 
     def calculate_equilibrium_calcium(self):
         # Solve for equilibrium calcium concentration
-        # This is a simplified calculation and might need adjustment
+        # This is a simplified calculation and might need adjustment; steady_state()
+        # solves for the rest of the full model
         a = self.serca_rate
         b = self.serca_k**2 - self.leak_rate / self.serca_rate
         c = -self.leak_rate * self.serca_k**2 / self.serca_rate
@@ -65,111 +149,956 @@ class CalciumModel:
         eq_calcium = (-b + np.sqrt(b**2 - 4*a*c)) / (2*a)
         return eq_calcium
 
+    # Continuous state fields, checked by the adaptive step size control
+    state_fields = ('calcium', 'er_calcium', 'mito_calcium', 'ip3_conc', 'buffer_bound')
+    # Cell geometry, stored alongside the state in checkpoints
+    geometry_fields = ('er', 'mitochondria', 'pm', 'ip3r_clusters')
+
+    def state_shape(self):
+        """Shape of the state arrays advanced by step()"""
+        return (self.grid_size,) * self.ndim
+
+    def diffusion_kernel(self):
+        """Stencil applied as D / dx**2 * convolve(field, kernel).
+
+        The 2D kernel has the continuum limit 0.3 * dx**2 * Laplacian. In 3D
+        the 7-point stencil is scaled to the same limit (0.3 on each face
+        neighbour), so D means the same in both modes.
+        """
+        if self.ndim == 3:
+            kernel = np.zeros((3, 3, 3))
+            kernel[1, 1, 1] = -1.8
+            kernel[0, 1, 1] = kernel[2, 1, 1] = kernel[1, 0, 1] = kernel[1, 2, 1] = \
+                kernel[1, 1, 0] = kernel[1, 1, 2] = 0.3
+            return kernel
+        return np.array([[0.05, 0.2, 0.05],
+                         [0.2, -1, 0.2],
+                         [0.05, 0.2, 0.05]])
+
     def reset(self):
-        self.calcium = np.full((self.grid_size, self.grid_size), self.eq_calcium, dtype=np.float64)
-        self.er_calcium = np.full((self.grid_size, self.grid_size), self.er_calcium_init, dtype=np.float64)
-        self.mito_calcium = np.full((self.grid_size, self.grid_size), self.mito_calcium_init, dtype=np.float64)
+        shape = self.state_shape()
+        self.dtype = np.dtype(self.dtype)
+        self.kernel = self.diffusion_kernel()
+        self.calcium = np.full(shape, self.eq_calcium, dtype=self.dtype)
+        self.er_calcium = np.full(shape, self.er_calcium_init, dtype=self.dtype)
+        self.mito_calcium = np.full(shape, self.mito_calcium_init, dtype=self.dtype)
+
+        self.ip3r_open = np.zeros(shape, dtype=np.int32)
+        self.ip3r_clusters = np.zeros(shape, dtype=np.int32)
+        self.ip3_conc = np.zeros(shape, dtype=self.dtype)
+        self.buffer_bound = np.full(shape,
+                                    self.buffer_total * self.eq_calcium / (self.eq_calcium + self.buffer_kd),
+                                    dtype=self.dtype)
+        if self.refine > 1 and len(shape) != 2:
+            raise ValueError("Adaptive refinement is only available for single 2D models")
+        self.patches = refinement.PatchHierarchy(self) if self.refine > 1 else None
+        self.index_ip3r_sites()
 
-        self.ip3r_open = np.zeros((self.grid_size, self.grid_size), dtype=np.int32)
-        self.ip3r_clusters = np.zeros((self.grid_size, self.grid_size), dtype=np.int32)
-        self.ip3_conc = np.zeros((self.grid_size, self.grid_size), dtype=np.float64)
-        self.buffer_bound = self.buffer_total * self.eq_calcium / (self.eq_calcium + self.buffer_kd)
+        self.t = 0.0
+        # Scheduled stimulus.Stimulus protocols (times are absolute, so a
+        # reset clears them)
+        self.stimuli = []
+        self._dt_next = self.dt
+        self._last_increments = None
+        self._slow_steps = 0
+        self._slow_elapsed = 0.0
+
+        if self.backend == "fused":
+            self.allocate_work_buffers()
+
+    def allocate_work_buffers(self):
+        """Preallocate the scratch arrays and row tiles used by the fused step kernel"""
+        shape = self.calcium.shape
+        self._work = {name: np.empty(shape, dtype=self.dtype)
+                      for name in ('acc', 't1', 't2', 't3')}
+
+        # Split the first spatial axis (rows in 2D, z-slabs in 3D) into tiles;
+        # each tile keeps a buffer for convolving its rows together with a
+        # one-row halo on either side
+        axis = len(shape) - self.ndim
+        n_rows = shape[axis]
+        rest = (slice(None),) * (self.ndim - 1)
+        n_tiles = max(1, min(self.tiles or self.threads, n_rows))
+        bounds = np.linspace(0, n_rows, n_tiles + 1).astype(int)
+        self._tiles = []
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            halo_lo, halo_hi = max(lo - 1, 0), min(hi + 1, n_rows)
+            self._tiles.append({
+                'span': (lo, hi),
+                'rows': (Ellipsis, slice(lo, hi)) + rest,
+                'halo': (Ellipsis, slice(halo_lo, halo_hi)) + rest,
+                'inner': (Ellipsis, slice(lo - halo_lo, hi - halo_lo)) + rest,
+                'conv': np.empty(shape[:axis] + (halo_hi - halo_lo,) + shape[axis + 1:], dtype=self.dtype),
+                'ip3': np.empty(shape[:axis] + (hi - lo,) + shape[axis + 1:], dtype=self.dtype),
+            })
+        self._tile_sites = None
+        if self._pool is None and self.threads > 1:
+            self._pool = ThreadPoolExecutor(max_workers=self.threads)
 
     def create_cell_structure(self):
-        # Create reticulated ER
-        self.er = np.zeros((self.grid_size, self.grid_size), dtype=np.float64)
-        for _ in range(50):  # Add 50 ER tubules
-            x, y = np.random.randint(0, self.grid_size, 2)
-            length = np.random.randint(20, 50)
-            angle = np.random.rand() * 2 * np.pi
-            dx, dy = int(length * np.cos(angle)), int(length * np.sin(angle))
-            rr, cc = line(x, y, x + dx, y + dy)
-            rr = np.clip(rr, 0, self.grid_size - 1)
-            cc = np.clip(cc, 0, self.grid_size - 1)
-            self.er[rr, cc] = 1
-        self.er = binary_dilation(self.er, iterations=2)  # Thicken ER tubules
-
-        # Create mitochondria
-        self.mitochondria = np.zeros((self.grid_size, self.grid_size), dtype=np.float64)
-        for _ in range(20):  # Add 20 mitochondria
-            x, y = np.random.randint(0, self.grid_size, 2)
-            self.mitochondria[max(0, x-5):min(self.grid_size, x+5),
-                              max(0, y-2):min(self.grid_size, y+2)] = 1
-
-        # Create plasma membrane
-        self.pm = np.zeros((self.grid_size, self.grid_size), dtype=np.float64)
-        self.pm[0, :] = self.pm[-1, :] = self.pm[:, 0] = self.pm[:, -1] = 1
-
-        # Create IP3R clusters on ER
-        self.ip3r_clusters = np.zeros((self.grid_size, self.grid_size), dtype=np.int32)
-        er_sites = np.where(self.er == 1)
-        num_clusters = int(len(er_sites[0]) * self.ip3r_cluster_density)
-        cluster_indices = np.random.choice(len(er_sites[0]), num_clusters, replace=False)
-        for idx in cluster_indices:
-            self.ip3r_clusters[er_sites[0][idx], er_sites[1][idx]] = np.random.poisson(self.ip3r_per_cluster)
-
-
-    def step(self):
-        # IP3R dynamics
-        open_prob = self.ip3r_open_rate * np.minimum(self.calcium, 1000)**2 * self.ip3_conc**2 / \
-                    ((np.minimum(self.calcium, 1000) + 0.3)**3 * (self.ip3_conc + 0.2)**2)
-        close_prob = self.ip3r_close_rate * np.minimum(self.calcium, 1000) / (np.minimum(self.calcium, 1000) + 0.3)
-
-        opening = (np.random.rand(*self.ip3r_open.shape) < open_prob * (self.ip3r_clusters - self.ip3r_open)).astype(np.int32)
-        closing = (np.random.rand(*self.ip3r_open.shape) < close_prob * self.ip3r_open).astype(np.int32)
-
-        self.ip3r_open += opening - closing
-        self.ip3r_open = np.clip(self.ip3r_open, 0, self.ip3r_clusters)
-
-        # Calcium dynamics
-        j_ip3r = 5 * self.ip3r_open * (self.er_calcium - self.calcium) * self.er
-        j_leak = self.leak_rate * (self.er_calcium - self.calcium) * self.er
-        j_serca = self.serca_rate * (self.calcium**2 / (self.calcium**2 + self.serca_k**2)) * self.er
-        j_pmca = self.pmca_rate * self.calcium * self.pm
-        j_mcu = self.mcu_rate * (self.calcium - self.mito_calcium) * self.mitochondria
-
-        # Buffer dynamics
-        buffer_free = self.buffer_total - self.buffer_bound
-        j_buffer = self.buffer_kon * (self.calcium * buffer_free - self.buffer_kd * self.buffer_bound)
-
-        dcdt_ip3r = j_ip3r
-        dcdt_leak = j_leak
-        dcdt_serca = -j_serca
-        dcdt_diff_ca = self.D_ca * convolve(self.calcium, self.kernel) / (self.dx**2)
-        dcdt_pmca = -j_pmca
-        dcdt_mcu = -j_mcu
-        dcdt_buffer = -j_buffer
-
-        self.calcium += (dcdt_ip3r + dcdt_leak + dcdt_serca + dcdt_diff_ca + dcdt_pmca + dcdt_mcu + dcdt_buffer) * self.dt
-        self.er_calcium -= (dcdt_ip3r + dcdt_leak + dcdt_serca) * self.dt * self.er
-        self.mito_calcium += j_mcu * self.dt
-
-        self.buffer_bound += j_buffer * self.dt
-
-        # IP3 dynamics
-        dcdt_diff_ip3 = self.D_ip3 * convolve(self.ip3_conc, self.kernel) / (self.dx**2)
-        self.ip3_conc += (dcdt_diff_ip3 - self.ip3_degradation_rate * self.ip3_conc) * self.dt
+        self.er, self.mitochondria, self.pm, self.ip3r_clusters = self.generate_cell_structure(
+            self.ip3r_cluster_density, self.ip3r_per_cluster, self.geometry_seed)
+        self.index_compartments()
+        self.index_ip3r_sites()
+
+    def generate_cell_structure(self, ip3r_cluster_density, ip3r_per_cluster, seed):
+        """Cell layout (er, mitochondria, pm, ip3r_clusters) for a geometry seed.
+
+        Layouts come from the geometry cache, so the arrays are shared and
+        read-only; they are regenerated only for a new grid size, cluster
+        density, cluster size or seed.
+        """
+        return geometry.cell_structure(self.grid_size, ip3r_cluster_density, ip3r_per_cluster, seed, self.ndim)
+
+    def index_compartments(self):
+        """Build flat indices of the ER, mitochondria and plasma membrane pixels.
+
+        The masks are boolean grids; the membrane fluxes are evaluated only at
+        these indices and scattered into the cytosolic update.
+        """
+        shape = self.state_shape()
+        self.er_sites = np.flatnonzero(np.broadcast_to(self.er, shape))
+        self.mito_sites = np.flatnonzero(np.broadcast_to(self.mitochondria, shape))
+        self.pm_sites = np.flatnonzero(np.broadcast_to(self.pm, shape))
+
+    def index_ip3r_sites(self):
+        """Build the compact site representation of the IP3R clusters.
+
+        Gating only runs at pixels that carry channels, so the clusters are
+        kept as flat indices into the state arrays together with per-site
+        channel and open counts. ip3r_open mirrors the open counts on the grid.
+        """
+        clusters = np.broadcast_to(self.ip3r_clusters, self.ip3r_open.shape)
+        self.ip3r_sites = np.flatnonzero(clusters)
+        self.ip3r_site_channels = clusters.ravel()[self.ip3r_sites]
+        self.ip3r_site_open = self.ip3r_open.flat[self.ip3r_sites]
+        if self.patches is not None:
+            self.patches.index_sites()
+
+    def site_values(self, value, sites=None):
+        """Values of a model parameter at the given flat sites (the IP3R sites by default)"""
+        return value
+
+    def step(self, dt=None, notify=True):
+        """Advance the model by one time step (of self.dt unless dt is given).
+
+        The callbacks are called afterwards unless notify is False, as for
+        the trial steps of adaptive stepping, which may still be rolled back.
+        """
+        dt = self.dt if dt is None else float(dt)
+        with self._phase('step'):
+            if self.stimuli:
+                with self._phase('stimulus'):
+                    self._apply_stimuli(dt)
+            with self._phase('gating'):
+                self.update_ip3r_channels(dt)
+            slow_dt = self._slow_step(dt)
+            if self.backend == "fused":
+                self._step_fused(dt, slow_dt)
+            else:
+                self._step_numpy(dt, slow_dt)
+            if self.patches is not None:
+                with self._phase('refinement'):
+                    self.patches.step(dt)
+            self.t += dt
+            if notify:
+                self.notify()
+
+    def notify(self):
+        """Call the callbacks with the current (accepted) state"""
+        with self._phase('callbacks'):
+            for callback in self.callbacks:
+                callback(self)
+
+    def _apply_stimuli(self, dt):
+        # Release the IP3 each scheduled stimulus delivers during [t, t + dt).
+        # Stimuli that ended before t can no longer contribute and are dropped
+        # (a rejected adaptive step only ever rolls back to the current t).
+        t0, t1 = self.t, self.t + dt
+        self.stimuli = [s for s in self.stimuli if s.end > t0]
+        ip3 = self.ip3_conc.reshape(-1, self.grid_size ** self.ndim)
+        for s in self.stimuli:
+            amount = s.amount(t0, t1)
+            if amount == 0:
+                continue
+            if s.footprint is None:
+                ip3 += amount
+                np.clip(ip3, 0, 10, out=ip3)
+            else:
+                ip3[:, s.footprint] = np.clip(ip3[:, s.footprint] + amount, 0, 10)
+
+    def schedule_stimulus(self, stimuli):
+        """Schedule a stimulus.Stimulus (or a list of them, e.g. a train)"""
+        if isinstance(stimuli, stimulus.Stimulus):
+            stimuli = [stimuli]
+        self.stimuli.extend(stimuli)
+
+    def clear_stimuli(self):
+        self.stimuli = []
+
+    def _slow_step(self, dt):
+        # Time to advance the slow processes by in this step (0 when skipped)
+        self._slow_steps += 1
+        self._slow_elapsed += dt
+        if self._slow_steps < self.slow_interval:
+            return 0.0
+        slow_dt = self._slow_elapsed
+        self._slow_steps = 0
+        self._slow_elapsed = 0.0
+        return slow_dt
+
+    def advance(self, duration):
+        """Advance the model by `duration` seconds of simulated time.
+
+        Without adaptive stepping this takes steps of self.dt, shortening the
+        last one to land on the end time. With adaptive=True the step size is
+        chosen per step: the local error of each step is estimated from the
+        change in the state increment between consecutive steps and compared
+        against atol + rtol * |state|. Steps above tolerance are rolled back
+        and retried with a smaller dt; quiet steps grow dt up to dt_max.
+        A trial step whose error is not finite is always rejected, and raises
+        FloatingPointError if it is already at dt_min.
+
+        Returns a dict with the number of accepted and rejected steps and the
+        simulated time reached.
+        """
+        t_end = self.t + duration
+        accepted = rejected = jumps = 0
+        retried = False
+        while t_end - self.t > 1e-9 * self.dt:
+            if self.fast_forward and self.patches is None and not self.ip3r_site_open.any():
+                steps, jumped = self._fast_forward(t_end)
+                accepted += steps
+                jumps += jumped
+                continue
+            if not self.adaptive:
+                remaining = t_end - self.t
+                self.step(self.dt if remaining > self.dt * (1 - 1e-9) else remaining)
+                accepted += 1
+                continue
+
+            dt_min = self.dt / 100 if self.dt_min is None else self.dt_min
+            dt_max = self.dt * 100 if self.dt_max is None else self.dt_max
+            proposed = min(max(self._dt_next, dt_min), dt_max)
+            dt = min(proposed, t_end - self.t)
+            saved = self.snapshot()
+            # A trial step that is too large may overflow; it is rejected
+            # below, so the warnings it raises are only noise
+            with np.errstate(over='ignore', invalid='ignore'):
+                self.step(dt, notify=False)
+                error, increments = self._estimate_step_error(saved, dt)
+            if not np.isfinite(error) and dt <= dt_min:
+                self.restore(saved)
+                raise FloatingPointError(f"Adaptive step diverged at t={self.t:g} even at dt_min={dt_min:g}")
+            if error <= 1 or dt <= dt_min:
+                accepted += 1
+                self.notify()
+                self._last_increments = (dt, increments)
+                if dt == proposed:
+                    # Do not grow straight after a rejection, to avoid
+                    # oscillating around the largest acceptable step
+                    growth = 1.0 if retried else 2.0
+                    self._dt_next = min(dt * min(growth, 0.9 / np.sqrt(max(error, 1e-12))), dt_max)
+                retried = False
+            else:
+                rejected += 1
+                retried = True
+                self.restore(saved)
+                self._dt_next = max(dt * max(0.1, 0.8 / error), dt_min)
+        return {'accepted': accepted, 'rejected': rejected, 'jumps': jumps, 't': float(self.t)}
+
+    def _fast_forward(self, t_end):
+        # With no channel open the cell only drifts slowly towards rest until
+        # the next opening. Step through one full slow_interval to measure the
+        # drift of every field, the slowly updated ones included; if it is
+        # slow, jump ahead (extrapolating the drift linearly, within atol +
+        # rtol of every value) by the sampled waiting time to the next
+        # opening, the next stimulus or the end time, whichever is first.
+        # Returns the number of steps taken and whether it jumped.
+        if self._slow_steps:
+            # Finish the current slow interval first, so the probe covers a whole one
+            self.step(min(self.dt, t_end - self.t))
+            return 1, 0
+        saved = {name: getattr(self, name).copy() for name in self.state_fields}
+        start = self.t
+        steps = 0
+        while True:
+            self.step(min(self.dt, t_end - self.t))
+            steps += 1
+            if self.ip3r_site_open.any() or any(s.start <= self.t < s.end for s in self.stimuli):
+                return steps, 0
+            if not self._slow_steps or t_end - self.t <= 1e-9 * self.dt:
+                break
+        elapsed = self.t - start
+
+        limit = np.inf
+        drift = {}
+        for name in self.state_fields:
+            value = getattr(self, name)
+            drift[name] = change = value - saved[name]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                limit = min(limit, float(np.min((self.atol + self.rtol * np.abs(value)) / np.abs(change))) * elapsed)
+        rates = self.ip3r_opening_rates()
+        total = float(rates.sum())
+        wait = self.rng.exponential(1 / total) if total > 0 else np.inf
+        starts = [s.start for s in self.stimuli if s.start > self.t]
+        jump = min(limit, wait, t_end - self.t, min(starts, default=np.inf) - self.t)
+        if jump < 2 * self.dt:
+            return steps, 0
+
+        for name, change in drift.items():
+            getattr(self, name)[...] += change * (jump / elapsed)
+        self.t += jump
+        if wait == jump:
+            site = self.rng.choice(len(rates), p=rates / total)
+            self.ip3r_site_open[site] += 1
+            self.ip3r_open.flat[self.ip3r_sites[site]] = self.ip3r_site_open[site]
+        self._last_increments = None
+        self.notify()
+        return steps, 1
+
+    def steady_state(self, fields=('calcium', 'mito_calcium', 'ip3_conc', 'buffer_bound'), tol=None,
+                     maxiter=100):
+        """Solve for the steady state of the deterministic model and adopt it.
+
+        The fields listed are solved for step(x) = x with Newton-Krylov, with the
+        channel gating frozen and the other state fields held at their current
+        values, so the result is the spatially heterogeneous rest of this
+        geometry with its PMCA, MCU and buffering. The model has no Ca2+ influx,
+        so with er_calcium included the only steady state is a depleted cell;
+        by default the ER content is held and the cytosol, mitochondria,
+        buffer and IP3 come to rest around it. The Krylov solves are
+        preconditioned with the linearised reaction-diffusion operator,
+        inverted in the cosine basis. The solve runs in double precision for
+        either dtype, and tol defaults to a multiple of its rounding error.
+        Returns the final residual (the largest relative rate of change, 1/s).
+        """
+        # Finite-difference Newton cannot resolve a single-precision step, so
+        # the solve always runs in double precision and is rounded at the end
+        dtype = self.dtype
+        self._set_dtype(np.float64)
+        try:
+            return self._solve_steady_state(fields, tol, maxiter)
+        finally:
+            self._set_dtype(dtype)
+
+    def _set_dtype(self, dtype):
+        self.dtype = np.dtype(dtype)
+        for name in self.state_fields:
+            setattr(self, name, getattr(self, name).astype(self.dtype))
+        if self.backend == "fused":
+            self.allocate_work_buffers()
+
+    def _solve_steady_state(self, fields, tol, maxiter):
+        if 'calcium' in fields:
+            self._rest_guess(fields)
+        saved = self.snapshot()
+        scales = {name: max(float(np.max(np.abs(getattr(self, name)))), 1e-6) for name in fields}
+        sizes = [getattr(self, name).size for name in fields]
+        offsets = np.cumsum([0] + sizes)
+        shape = self.state_shape()
+
+        def unpack(x):
+            for name, lo, hi in zip(fields, offsets[:-1], offsets[1:]):
+                setattr(self, name, (x[lo:hi] * scales[name]).reshape(shape).astype(self.dtype))
+
+        def residual(x):
+            self.restore(saved)
+            unpack(x)
+            if self.backend == "fused":
+                self._step_fused(self.dt, self.dt)
+            else:
+                self._step_numpy(self.dt, self.dt)
+            return np.concatenate([(getattr(self, name).ravel() / scales[name] - x[lo:hi]) / self.dt
+                                   for name, lo, hi in zip(fields, offsets[:-1], offsets[1:])])
+
+        x0 = np.concatenate([getattr(self, name).ravel() / scales[name] for name in fields]).astype(np.float64)
+        if tol is None:
+            # A multiple of the rounding error of one double-precision step
+            tol = 1e7 * np.finfo(self.dtype).eps
+        try:
+            solution = newton_krylov(residual, x0, f_tol=tol, maxiter=maxiter, method='gmres',
+                                     inner_M=self._steady_state_preconditioner(fields, residual, x0, offsets))
+        except NoConvergence as e:
+            # The last iterate is still the best estimate
+            solution = e.args[0]
+            print(f"Warning: steady state did not converge to {tol:.2e}")
+        final = float(np.max(np.abs(residual(solution))))
+        self.restore(saved)
+        unpack(solution)
+        self._last_increments = None
+        return final
+
+    def _steady_state_preconditioner(self, fields, residual, x0, offsets, step=1e-6):
+        # Approximate inverse Jacobian of the residual: the linearised
+        # reaction-diffusion operator with the reactions averaged over the
+        # cell, which the cosine basis of diffuse_implicit diagonalises up to
+        # one small field-by-field system per mode. It captures diffusion,
+        # buffered diffusion and the slow whole-cell balance; Krylov handles
+        # the spatial heterogeneity of the membranes and organelles. The
+        # averaged reaction Jacobian comes from the residual's response to a
+        # uniform perturbation of each field, which diffusion leaves alone
+        shape = self.state_shape()
+        axes = tuple(range(-self.ndim, 0))
+        batch = shape[:-self.ndim]
+        eigenvalues = np.broadcast_to(self.kernel_eigenvalues(shape) / self.dx**2, shape)
+        diffusivity = {'calcium': self.D_ca, 'ip3_conc': self.D_ip3}
+        base = residual(x0)
+        rates = np.empty(batch + (len(fields), len(fields)))
+        for j, (lo, hi) in enumerate(zip(offsets[:-1], offsets[1:])):
+            probe = x0.copy()
+            probe[lo:hi] += step
+            response = (residual(probe) - base) / step
+            for i, (lo_i, hi_i) in enumerate(zip(offsets[:-1], offsets[1:])):
+                rates[..., i, j] = response[lo_i:hi_i].reshape(shape).mean(axis=axes)
+        laplacians = np.stack([np.broadcast_to(diffusivity.get(name, 0) * eigenvalues, shape)
+                               for name in fields], axis=-1)
+        # One system per mode, slightly shifted so that exactly conserved
+        # quantities do not make the zero mode singular
+        systems = rates[(Ellipsis,) + (np.newaxis,) * self.ndim + (slice(None),) * 2] \
+            + laplacians[..., np.newaxis] * np.eye(len(fields)) - 1e-6 * np.eye(len(fields))
+        inverse = np.linalg.inv(systems)
+        if self.diffusion == "implicit":
+            # step() applies the implicit diffusion after the reactions
+            inverse = inverse * (1 - self.dt * laplacians[..., np.newaxis, :])
+
+        def apply(v):
+            spectra = np.stack([dctn(v[lo:hi].reshape(shape), type=2, norm='ortho', axes=axes, workers=self.threads)
+                                for lo, hi in zip(offsets[:-1], offsets[1:])], axis=-1)
+            spectra = np.einsum('...ij,...j->...i', inverse, spectra)
+            return np.concatenate([idctn(spectra[..., i], type=2, norm='ortho', axes=axes,
+                                         workers=self.threads).ravel() for i in range(len(fields))])
+
+        n = len(x0)
+        return LinearOperator((n, n), matvec=apply, dtype=np.float64)
+
+    def _rest_guess(self, fields):
+        # Newton from an arbitrary state overshoots badly: SERCA is steep and
+        # only the PMCA damps the total calcium. Start instead from the
+        # well-mixed rest of each cell, where ER release balances PMCA
+        # extrusion, found by bisection since the net flux falls with Ca2+
+        cells = self.grid_size ** self.ndim
+        n = self.calcium.size // cells
+        shape = self.calcium.shape
+        lo = np.zeros(n)
+        hi = np.full(n, max(float(self.er_calcium.max()), float(self.calcium.max())))
+        for _ in range(60):
+            c = (lo + hi) / 2
+            self.calcium = np.repeat(c, cells).reshape(shape).astype(self.dtype)
+            net = np.bincount(self.er_sites // cells, self.er_exchange_flux(self.er_sites), minlength=n)
+            net += np.bincount(self.ip3r_sites // cells, self.ip3r_site_flux(), minlength=n)
+            net -= np.bincount(self.pm_sites // cells, self.pmca_flux(self.pm_sites), minlength=n)
+            lo, hi = np.where(net > 0, c, lo), np.where(net > 0, hi, c)
+        c = np.repeat((lo + hi) / 2, cells).reshape(shape)
+        self.calcium = c.astype(self.dtype)
+        if 'mito_calcium' in fields:
+            self.mito_calcium.flat[self.mito_sites] = c.flat[self.mito_sites]
+        if 'buffer_bound' in fields:
+            self.buffer_bound = (self.buffer_total * c / (c + self.buffer_kd)).astype(self.dtype)
+
+    def run_until(self, t_end):
+        """Advance the model up to simulated time t_end (see advance)"""
+        return self.advance(t_end - self.t)
+
+    def advance_cached(self, duration, cache, observables=None):
+        """advance(duration) through a result_cache.ResultCache.
+
+        If the same run (parameters, seed, starting state, stimuli, duration
+        and observables) is already in the cache, its final state is loaded
+        and the traces it recorded are appended to `observables` instead of
+        simulating. Otherwise the run is simulated and stored. Pass the
+        Observables attached to the model's callbacks; other callbacks are
+        not called for a cached run. Returns the advance() counts with
+        'cached' set to whether the cache was used.
+        """
+        key = cache.key(self, observables, duration=duration)
+        result = cache.load(key, self, observables)
+        if result is not None:
+            return dict(result, cached=True)
+        start = cache.mark(observables)
+        result = self.advance(duration)
+        cache.store(key, self, observables, start, record=result)
+        return dict(result, cached=False)
+
+    def _estimate_step_error(self, saved, dt):
+        # Forward Euler has local error ~ dt**2/2 * y''. The second derivative
+        # is estimated from how far this step's increment departs from the
+        # previous increment rescaled to the current dt.
+        error = 0.0
+        increments = {}
+        for name in self.state_fields:
+            old, new = saved[name], getattr(self, name)
+            increment = new - old
+            local = increment
+            if self._last_increments is not None:
+                last_dt, last = self._last_increments
+                local = increment - last[name] * (dt / last_dt)
+            scale = self.atol + self.rtol * np.maximum(np.abs(old), np.abs(new))
+            field_error = 0.5 * float(np.max(np.abs(local) / scale))
+            error = max(error, field_error if np.isfinite(field_error) else np.inf)
+            increments[name] = increment
+        return error, increments
+
+    def snapshot(self):
+        """Copy of the evolving state, including the random generator state"""
+        saved = {name: getattr(self, name).copy() for name in self.state_fields}
+        saved['ip3r_open'] = self.ip3r_open.copy()
+        saved['ip3r_site_open'] = self.ip3r_site_open.copy()
+        saved['t'] = self.t
+        saved['slow'] = (self._slow_steps, self._slow_elapsed)
+        saved['rng'] = self.rng.bit_generator.state
+        if self.patches is not None:
+            saved['patches'] = self.patches.snapshot()
+        return saved
+
+    def restore(self, saved):
+        """Return to a state captured by snapshot()"""
+        for name in self.state_fields + ('ip3r_open', 'ip3r_site_open'):
+            getattr(self, name)[...] = saved[name]
+        self.t = saved['t']
+        self._slow_steps, self._slow_elapsed = saved['slow']
+        self.rng.bit_generator.state = saved['rng']
+        if self.patches is not None:
+            self.patches.restore(saved['patches'])
+
+    def update_ip3r_channels(self, dt):
+        """Stochastic IP3R gating, evaluated at the cluster sites only"""
+        if self.gating == "binomial":
+            self._update_ip3r_channels_binomial(dt)
+        else:
+            self._update_ip3r_channels_uniform(dt)
+
+    def _update_ip3r_channels_uniform(self, dt):
+        # One uniform draw per site and direction: the open/close values are
+        # used directly as probabilities per step of self.dt (scaled for other
+        # step sizes), so at most one channel per site opens or closes in a step
+        sites = self.ip3r_sites
+        open_prob, close_prob = self.ip3r_site_rates()
+        if dt != self.dt:
+            open_prob *= dt / self.dt
+            close_prob *= dt / self.dt
+
+        site_open = self.ip3r_site_open
+        opening = self.rng.random(len(sites)) < open_prob * (self.ip3r_site_channels - site_open)
+        closing = self.rng.random(len(sites)) < close_prob * site_open
+
+        site_open += opening
+        site_open -= closing
+        np.clip(site_open, 0, self.ip3r_site_channels, out=site_open)
+        self.ip3r_open.flat[sites] = site_open
+
+    def _update_ip3r_channels_binomial(self, dt):
+        # The open/close values are per-channel rates (1/s). With Ca2+ and IP3
+        # frozen over the step, every channel is an independent two-state
+        # Markov process, so the number of channels switching is exactly
+        # binomial for any dt and several channels may switch per step
+        sites = self.ip3r_sites
+        k_open, k_close = self.ip3r_site_rates()
+
+        k_total = k_open + k_close
+        relaxed = -np.expm1(-k_total * dt)
+        p_open = np.divide(k_open * relaxed, k_total, out=np.zeros_like(k_total), where=k_total > 0)
+        p_close = np.divide(k_close * relaxed, k_total, out=np.zeros_like(k_total), where=k_total > 0)
+
+        site_open = self.ip3r_site_open
+        closed = self.ip3r_site_channels - site_open
+        site_open[:] = self.rng.binomial(site_open, 1 - p_close) + self.rng.binomial(closed, p_open)
+        self.ip3r_open.flat[sites] = site_open
+
+    def ip3r_site_rates(self):
+        """Per-channel open and close values of the IP3R sites at the current Ca2+ and IP3"""
+        sites = self.ip3r_sites
+        calcium = np.minimum(self.calcium.flat[sites], 1000)
+        ip3 = self.ip3_conc.flat[sites]
+        k_open = self.site_values(self.ip3r_open_rate) * calcium**2 * ip3**2 / \
+                 ((calcium + 0.3)**3 * (ip3 + 0.2)**2)
+        k_close = self.site_values(self.ip3r_close_rate) * calcium / (calcium + 0.3)
+        return k_open, k_close
+
+    def ip3r_opening_rates(self):
+        """Rate (1/s) at which a closed channel opens at each IP3R site"""
+        k_open, _ = self.ip3r_site_rates()
+        if self.gating != "binomial":
+            # The uniform engine uses the values as probabilities per step of self.dt
+            k_open = k_open / self.dt
+        return k_open * (self.ip3r_site_channels - self.ip3r_site_open)
+
+    def nanodomain_calcium(self):
+        """Cytosolic Ca2+ at the IP3R sites, reconstructed at the fine spacing in refined patches.
+
+        The reconstruction is diagnostic: gating and release use the pixel
+        values (see refinement.py).
+        """
+        calcium = self.calcium.flat[self.ip3r_sites]
+        if self.patches is not None:
+            calcium = self.patches.site_calcium(calcium)
+        return calcium
+
+    def ip3r_site_flux(self):
+        """Ca2+ release through the open IP3Rs at the cluster sites (sites lie on the ER)"""
+        sites = self.ip3r_sites
+        return 5 * self.ip3r_site_open.astype(self.dtype) * (self.er_calcium.flat[sites] - self.calcium.flat[sites])
+
+    def er_exchange_flux(self, sites):
+        """Leak minus SERCA uptake (net ER release) at the given ER pixels"""
+        calcium = self.calcium.flat[sites]
+        j_leak = self.site_values(self.leak_rate, sites) * (self.er_calcium.flat[sites] - calcium)
+        j_serca = self.site_values(self.serca_rate, sites) * \
+            (calcium**2 / (calcium**2 + self.site_values(self.serca_k, sites)**2))
+        return j_leak - j_serca
+
+    def mcu_flux(self, sites):
+        """Mitochondrial Ca2+ uptake at the given mitochondrial pixels"""
+        return self.site_values(self.mcu_rate, sites) * (self.calcium.flat[sites] - self.mito_calcium.flat[sites])
+
+    def pmca_flux(self, sites):
+        """Ca2+ extrusion by the PMCA at the given plasma membrane pixels"""
+        return self.site_values(self.pmca_rate, sites) * self.calcium.flat[sites]
+
+    def _step_numpy(self, dt, slow_dt):
+        phase = self._phase
+        # Slow ER and mitochondrial exchange (SERCA refilling, leak, MCU
+        # uptake), evaluated every slow_interval steps and scaled to act over
+        # the time accumulated since its last update. Membrane fluxes are
+        # computed on their own pixels only
+        with phase('fluxes'):
+            j_er = np.zeros_like(self.calcium)
+            if slow_dt:
+                j_exchange = self.er_exchange_flux(self.er_sites)
+                j_mcu = self.mcu_flux(self.mito_sites)
+                if slow_dt != dt:
+                    j_exchange *= slow_dt / dt
+                    j_mcu *= slow_dt / dt
+                j_er.flat[self.er_sites] = j_exchange
+                self._record_flux('er_exchange', j_exchange, dt)
+                self._record_flux('mcu', j_mcu, dt)
+            j_pmca = self.pmca_flux(self.pm_sites)
+            self._record_flux('pmca', j_pmca, dt)
+
+            # Net ER release, with the IP3R flux scattered in at the cluster sites
+            j_ip3r = self.ip3r_site_flux()
+            self._record_flux('ip3r', j_ip3r, dt)
+            j_er.flat[self.ip3r_sites] += j_ip3r
+            er_release = j_er.flat[self.er_sites] * dt
+
+        # Buffer dynamics (subcycled separately below when buffer_substeps > 1)
+        with phase('buffer'):
+            j_buffer = 0
+            if self.buffer_substeps == 1:
+                buffer_free = self.buffer_total - self.buffer_bound
+                j_buffer = self.buffer_kon * (self.calcium * buffer_free - self.buffer_kd * self.buffer_bound)
+                self._record_flux('buffer', j_buffer, dt)
+
+        with phase('ca_diffusion'):
+            if self.diffusion == "implicit":
+                dcdt = j_er
+            else:
+                dcdt_diff_ca = self.D_ca * convolve(self.calcium, self.kernel) / (self.dx**2)
+                dcdt = j_er + dcdt_diff_ca
+
+        with phase('fluxes'):
+            dcdt.flat[self.pm_sites] -= j_pmca
+            if slow_dt:
+                dcdt.flat[self.mito_sites] -= j_mcu
+            self.calcium += (dcdt - j_buffer) * dt
+            self.er_calcium.flat[self.er_sites] -= er_release
+            if slow_dt:
+                self.mito_calcium.flat[self.mito_sites] += j_mcu * dt
+
+        with phase('buffer'):
+            if self.buffer_substeps == 1:
+                self.buffer_bound += j_buffer * dt
+            else:
+                h = dt / self.buffer_substeps
+                for _ in range(self.buffer_substeps):
+                    buffer_free = self.buffer_total - self.buffer_bound
+                    j_buffer = self.buffer_kon * (self.calcium * buffer_free - self.buffer_kd * self.buffer_bound)
+                    self._record_flux('buffer', j_buffer, h)
+                    self.calcium -= j_buffer * h
+                    self.buffer_bound += j_buffer * h
+
+        if self.diffusion == "implicit":
+            with phase('ca_diffusion'):
+                self.calcium = self.diffuse_implicit(self.calcium, self.D_ca, dt)
+
+        # IP3 dynamics: diffusion subcycled ip3_substeps times, degradation slow
+        with phase('ip3_diffusion'):
+            h = dt / self.ip3_substeps
+            if self.diffusion == "implicit":
+                if slow_dt:
+                    self.ip3_conc -= self.ip3_degradation_rate * self.ip3_conc * slow_dt
+                for _ in range(self.ip3_substeps):
+                    self.ip3_conc = self.diffuse_implicit(self.ip3_conc, self.D_ip3, h)
+            elif self.ip3_substeps == 1 and slow_dt == dt:
+                dcdt_diff_ip3 = self.D_ip3 * convolve(self.ip3_conc, self.kernel) / (self.dx**2)
+                self.ip3_conc += (dcdt_diff_ip3 - self.ip3_degradation_rate * self.ip3_conc) * dt
+            else:
+                for _ in range(self.ip3_substeps):
+                    self.ip3_conc += self.D_ip3 * convolve(self.ip3_conc, self.kernel) / (self.dx**2) * h
+                if slow_dt:
+                    self.ip3_conc -= self.ip3_degradation_rate * self.ip3_conc * slow_dt
 
         # Ensure non-negative concentrations and prevent overflow
-        self.calcium = np.clip(self.calcium, 0, 1000)
-        self.er_calcium = np.clip(self.er_calcium, 0, 10000)
-        self.mito_calcium = np.clip(self.mito_calcium, 0, 1000)
-        self.ip3_conc = np.clip(self.ip3_conc, 0, 10)
-        self.buffer_bound = np.clip(self.buffer_bound, 0, self.buffer_total)
+        with phase('clamp'):
+            self.calcium = np.clip(self.calcium, 0, 1000)
+            self.er_calcium = np.clip(self.er_calcium, 0, 10000)
+            self.mito_calcium = np.clip(self.mito_calcium, 0, 1000)
+            self.ip3_conc = np.clip(self.ip3_conc, 0, 10)
+            self.buffer_bound = np.clip(self.buffer_bound, 0, self.buffer_total)
+
+    def _step_fused(self, dt, slow_dt):
+        # Same update as _step_numpy, evaluated in place on the preallocated
+        # work buffers so that no full-grid temporaries are created per step.
+        # The operation order mirrors _step_numpy so both paths agree exactly.
+        #
+        # The grid is processed as row tiles, run concurrently when threads > 1.
+        # Phases that read neighbouring rows (the diffusion stencil) only read
+        # state that no tile writes in the same phase, so the result does not
+        # depend on the number of tiles.
+        phase = self._phase
+        w = self._work
+        acc, t1, t2, t3 = w['acc'], w['t1'], w['t2'], w['t3']
+        current = (self.ip3r_sites, self.er_sites, self.mito_sites, self.pm_sites)
+        if self._tile_sites is None or any(a is not b for a, b in zip(self._tile_sites, current)):
+            self._assign_sites_to_tiles()
+        with phase('fluxes'):
+            site_flux = self.ip3r_site_flux()
+            self._record_flux('ip3r', site_flux, dt)
+        combined_ip3 = self.diffusion == "explicit" and self.ip3_substeps == 1 and slow_dt == dt
+
+        def reactions(tile):
+            r = tile['rows']
+            a, s1, s3 = acc[r], t1[r], t3[r]
+            er_sites, mito_sites, pm_sites = tile['er_sites'], tile['mito_sites'], tile['pm_sites']
+
+            # Calcium dynamics, accumulated into acc: net ER release first
+            # (kept for the ER update), then diffusion, PMCA, MCU and buffering.
+            # Membrane fluxes are computed on the tile's compartment pixels only
+            with phase('fluxes'):
+                a.fill(0)
+                if slow_dt:
+                    j_exchange = self.er_exchange_flux(er_sites)
+                    if slow_dt != dt:
+                        j_exchange *= slow_dt / dt
+                    acc.flat[er_sites] = j_exchange
+                    self._record_flux('er_exchange', j_exchange, dt)
+                acc.flat[tile['ip3r_sites']] += site_flux[tile['ip3r_mask']]
+                tile['er_release'] = acc.flat[er_sites] * dt
+
+            if self.diffusion == "explicit":
+                with phase('ca_diffusion'):
+                    a += self._diffusion_rate(self.calcium, self.D_ca, tile)
+            with phase('fluxes'):
+                j_pmca = self.pmca_flux(pm_sites)
+                self._record_flux('pmca', j_pmca, dt)
+                acc.flat[pm_sites] -= j_pmca
+                if slow_dt:
+                    tile['mcu'] = self.mcu_flux(mito_sites)
+                    if slow_dt != dt:
+                        tile['mcu'] *= slow_dt / dt
+                    self._record_flux('mcu', tile['mcu'], dt)
+                    acc.flat[mito_sites] -= tile['mcu']
+
+            # Buffer dynamics
+            if self.buffer_substeps == 1:
+                with phase('buffer'):
+                    self._buffer_flux(r, s1, s3)
+                    self._record_flux('buffer', s1, dt)
+                    a -= s1
+
+            # IP3 rate, read before any tile updates IP3
+            if combined_ip3:
+                with phase('ip3_diffusion'):
+                    s3[...] = self._diffusion_rate(self.ip3_conc, self.D_ip3, tile)
+                    np.multiply(self.ip3_conc[r], self.ip3_degradation_rate, out=tile['ip3'])
+                    s3 -= tile['ip3']
+                    s3 *= dt
+
+        def update(tile):
+            r = tile['rows']
+            calcium, ip3 = self.calcium[r], self.ip3_conc[r]
+            a, s1, s2, s3 = acc[r], t1[r], t2[r], t3[r]
+
+            with phase('fluxes'):
+                a *= dt
+                calcium += a
+                self.er_calcium.flat[tile['er_sites']] -= tile['er_release']
+                if slow_dt:
+                    self.mito_calcium.flat[tile['mito_sites']] += tile['mcu'] * dt
+            with phase('buffer'):
+                if self.buffer_substeps == 1:
+                    s1 *= dt
+                    self.buffer_bound[r] += s1
+                else:
+                    h = dt / self.buffer_substeps
+                    for _ in range(self.buffer_substeps):
+                        self._buffer_flux(r, s1, s2)
+                        self._record_flux('buffer', s1, h)
+                        s1 *= h
+                        calcium -= s1
+                        self.buffer_bound[r] += s1
+
+            # IP3 dynamics: diffusion subcycled ip3_substeps times, degradation slow
+            with phase('ip3_diffusion'):
+                if combined_ip3:
+                    ip3 += s3
+                elif self.diffusion == "implicit" and slow_dt:
+                    np.multiply(ip3, self.ip3_degradation_rate, out=s1)
+                    s1 *= slow_dt
+                    ip3 -= s1
+
+        def ip3_diffusion_rate(tile):
+            r = tile['rows']
+            t1[r] = self._diffusion_rate(self.ip3_conc, self.D_ip3, tile)
+            t1[r] *= h
+
+        def ip3_diffusion_update(tile):
+            self.ip3_conc[tile['rows']] += t1[tile['rows']]
+
+        def ip3_degradation(tile):
+            r = tile['rows']
+            np.multiply(self.ip3_conc[r], self.ip3_degradation_rate, out=t1[r])
+            t1[r] *= slow_dt
+            self.ip3_conc[r] -= t1[r]
+
+        def clamp(tile):
+            # Ensure non-negative concentrations and prevent overflow
+            r = tile['rows']
+            np.clip(self.calcium[r], 0, 1000, out=self.calcium[r])
+            np.clip(self.er_calcium[r], 0, 10000, out=self.er_calcium[r])
+            np.clip(self.mito_calcium[r], 0, 1000, out=self.mito_calcium[r])
+            np.clip(self.ip3_conc[r], 0, 10, out=self.ip3_conc[r])
+            np.clip(self.buffer_bound[r], 0, self.buffer_total, out=self.buffer_bound[r])
+
+        self._map_tiles(reactions)
+        self._map_tiles(update)
+
+        h = dt / self.ip3_substeps
+        if self.diffusion == "implicit":
+            with phase('ca_diffusion'):
+                np.copyto(self.calcium, self.diffuse_implicit(self.calcium, self.D_ca, dt))
+            with phase('ip3_diffusion'):
+                for _ in range(self.ip3_substeps):
+                    np.copyto(self.ip3_conc, self.diffuse_implicit(self.ip3_conc, self.D_ip3, h))
+        elif not combined_ip3:
+            with phase('ip3_diffusion'):
+                for _ in range(self.ip3_substeps):
+                    self._map_tiles(ip3_diffusion_rate)
+                    self._map_tiles(ip3_diffusion_update)
+                if slow_dt:
+                    self._map_tiles(ip3_degradation)
+
+        with phase('clamp'):
+            self._map_tiles(clamp)
+
+    def _phase(self, name):
+        # Timing context for one phase of step(), a no-op unless profiling
+        if self.profiler is None:
+            return _NO_PHASE
+        return self.profiler.phase(name)
+
+    def _record_flux(self, name, flux, dt):
+        if self.profiler is not None and self.profiler.fluxes:
+            self.profiler.add_flux(name, float(np.abs(flux).sum()) * dt)
+
+    def _diffusion_rate(self, field, D, tile):
+        # D * (kernel applied to field) / dx**2 on the tile's rows, convolving
+        # the tile together with its one-row halo
+        out = tile['conv']
+        convolve(field[tile['halo']], self.kernel, output=out)
+        out *= D
+        out /= self.dx**2
+        return out[tile['inner']]
+
+    def _buffer_flux(self, r, out, scratch):
+        # Net Ca2+ binding to the buffer on rows r, kon * (Ca * free - kd * bound)
+        np.subtract(self.buffer_total, self.buffer_bound[r], out=out)
+        out *= self.calcium[r]
+        np.multiply(self.buffer_bound[r], self.buffer_kd, out=scratch)
+        out -= scratch
+        out *= self.buffer_kon
+
+    def _map_tiles(self, function):
+        if self._pool is None or len(self._tiles) == 1:
+            for tile in self._tiles:
+                function(tile)
+        else:
+            list(self._pool.map(function, self._tiles))
+
+    def _assign_sites_to_tiles(self):
+        # Split the IP3R and compartment site indices by the tile owning their row
+        sites = {'ip3r': self.ip3r_sites, 'er': self.er_sites,
+                 'mito': self.mito_sites, 'pm': self.pm_sites}
+        shape = self.calcium.shape
+        row_size = int(np.prod(shape[len(shape) - self.ndim + 1:]))
+        for name, flat in sites.items():
+            rows = (flat // row_size) % shape[len(shape) - self.ndim]
+            for tile in self._tiles:
+                lo, hi = tile['span']
+                mask = (rows >= lo) & (rows < hi)
+                tile[name + '_mask'] = mask
+                tile[name + '_sites'] = flat[mask]
+        self._tile_sites = tuple(sites.values())
+
+    def diffuse_implicit(self, field, D, dt):
+        """Advance pure diffusion of field by one backward Euler step.
+
+        The cosine transform (DCT-II) diagonalises the diffusion kernel under
+        the reflective boundaries used by the explicit update, so
+        (I - dt * D / dx**2 * kernel) is inverted exactly by a division in
+        transform space. The solve is unconditionally stable for any dt.
+        """
+        axes = tuple(range(-self.ndim, 0))
+        spectrum = dctn(field, type=2, norm='ortho', axes=axes, workers=self.threads)
+        spectrum /= self._implicit_diffusion_factor(D, field.shape, dt)
+        return idctn(spectrum, type=2, norm='ortho', axes=axes, workers=self.threads)
+
+    def _implicit_diffusion_factor(self, D, shape, dt):
+        key = (np.asarray(D).tobytes(), dt, np.asarray(self.dx).tobytes(), shape, self.dtype)
+        factor = self._diffusion_factors.get(key)
+        if factor is None:
+            factor = (1 - dt * D / self.dx**2 * self.kernel_eigenvalues(shape)).astype(self.dtype)
+            if len(self._diffusion_factors) > 8:
+                self._diffusion_factors.clear()
+            self._diffusion_factors[key] = factor
+        return factor
+
+    def kernel_eigenvalues(self, shape):
+        """Eigenvalues of the (axis-symmetric) diffusion kernel for the cosine modes of shape"""
+        key = ('eigenvalues', shape)
+        eigenvalues = self._diffusion_factors.get(key)
+        if eigenvalues is None:
+            kernel = self.kernel.reshape((3,) * self.ndim)
+            # Cosine mode angles along each spatial axis, shaped to broadcast
+            thetas = [(np.pi * np.arange(n) / n).reshape((-1,) + (1,) * (self.ndim - 1 - axis))
+                      for axis, n in enumerate(shape[-self.ndim:])]
+            eigenvalues = 0
+            for offset in itertools.product((-1, 0, 1), repeat=self.ndim):
+                weight = kernel[tuple(o + 1 for o in offset)]
+                if weight == 0:
+                    continue
+                term = weight
+                for o, theta in zip(offset, thetas):
+                    term = term * np.cos(o * theta)
+                eigenvalues = eigenvalues + term
+            self._diffusion_factors[key] = eigenvalues
+        return eigenvalues
 
     def add_ip3_global(self, amount, duration):
-        """Simulate global uncaging of IP3"""
-        rate = amount / duration
-        self.ip3_conc += rate * self.dt
-        self.ip3_conc = np.clip(self.ip3_conc, 0, 10)
-
-    def add_ip3_local(self, x, y, radius, amount, duration):
-        """Simulate local uncaging of IP3"""
-        xx, yy = np.meshgrid(np.arange(self.grid_size), np.arange(self.grid_size))
-        mask = ((xx - x)**2 + (yy - y)**2 <= radius**2)
-        rate = amount / duration
-        self.ip3_conc[mask] += rate * self.dt
-        self.ip3_conc = np.clip(self.ip3_conc, 0, 10)
+        """Simulate global uncaging of IP3: `amount` μM released over the next `duration` seconds"""
+        self.schedule_stimulus(stimulus.pulse(amount, self.t, duration))
+
+    def add_ip3_local(self, x, y, radius, amount, duration, z=None):
+        """Simulate local uncaging of IP3 within `radius` pixels of (x, y) over the next `duration` seconds.
+
+        In 3D the spot is a ball around (x, y, z), by default in the middle z-plane.
+        """
+        if self.ndim == 3:
+            z = self.grid_size // 2 if z is None else z
+            footprint = stimulus.ball(self.grid_size, x, y, z, radius)
+        else:
+            footprint = stimulus.disk(self.grid_size, x, y, radius)
+        self.schedule_stimulus(stimulus.pulse(amount, self.t, duration, footprint))
 
     def set_buffer_conditions(self, total, kd, kon):
         self.buffer_total = total
@@ -177,8 +1106,8 @@ class CalciumModel:
         self.buffer_kon = kon
         self.reset()  # Reset the simulation with new buffer conditions
 
-    def save_parameters(self, filename):
-        params = {
+    def get_parameters(self):
+        return {
             'grid_size': self.grid_size,
             'dx': self.dx,
             'dt': self.dt,
@@ -198,8 +1127,29 @@ class CalciumModel:
             'buffer_kd': self.buffer_kd,
             'buffer_kon': self.buffer_kon,
             'er_calcium_init': self.er_calcium_init,
-            'mito_calcium_init': self.mito_calcium_init
+            'mito_calcium_init': self.mito_calcium_init,
+            'gating': self.gating,
+            'diffusion': self.diffusion,
+            'adaptive': self.adaptive,
+            'rtol': self.rtol,
+            'atol': self.atol,
+            'dt_min': self.dt_min,
+            'dt_max': self.dt_max,
+            'buffer_substeps': self.buffer_substeps,
+            'ip3_substeps': self.ip3_substeps,
+            'slow_interval': self.slow_interval,
+            'geometry_seed': self.geometry_seed,
+            'dtype': np.dtype(self.dtype).name,
+            'refine': self.refine,
+            'refine_radius': self.refine_radius,
+            'refine_gradient': self.refine_gradient,
+            'refine_interval': self.refine_interval,
+            'fast_forward': self.fast_forward,
+            'ndim': self.ndim
         }
+
+    def save_parameters(self, filename):
+        params = self.get_parameters()
         with open(filename, 'w') as f:
             json.dump(params, f)
 
@@ -207,11 +1157,7 @@ class CalciumModel:
         try:
             with open(filename, 'r') as f:
                 params = json.load(f)
-            for key, value in params.items():
-                if hasattr(self, key):
-                    setattr(self, key, value)
-                else:
-                    print(f"Warning: Unknown parameter '{key}' in file {filename}")
+            self.apply_parameters(params, f"file {filename}")
             self.reset()
             self.create_cell_structure()
         except FileNotFoundError:
@@ -220,3 +1166,143 @@ class CalciumModel:
             print(f"Error: File {filename} is not a valid JSON file.")
         except Exception as e:
             print(f"Error loading parameters from {filename}: {str(e)}")
+
+    def apply_parameters(self, params, source):
+        for key, value in params.items():
+            if hasattr(self, key):
+                setattr(self, key, value)
+            else:
+                print(f"Warning: Unknown parameter '{key}' in {source}")
+
+    def checkpoint_contents(self):
+        """(header, arrays) describing the complete simulation state.
+
+        The header holds the JSON-serializable part (parameters, time, step
+        scheduling, stimuli, patch layout and random generator state); the
+        arrays are the state, the geometry and the arrays the header refers
+        to by name. save_checkpoint writes exactly this, and the result cache
+        digests it.
+        """
+        arrays = {name: getattr(self, name) for name in self.state_fields + ('ip3r_open',) + self.geometry_fields}
+        last_dt = None
+        if self._last_increments is not None:
+            last_dt, increments = self._last_increments
+            arrays.update(('increment_' + name, value) for name, value in increments.items())
+        stimuli = []
+        for i, s in enumerate(self.stimuli):
+            entry = s.to_dict()
+            if s.footprint is not None:
+                entry['footprint'] = f'stimulus_{i}'
+                arrays[entry['footprint']] = s.footprint
+            stimuli.append(entry)
+        patches = None
+        if self.patches is not None:
+            saved_patches, patch_steps = self.patches.snapshot()
+            patches = {'steps': patch_steps, 'rects': [list(patch['rect']) for patch in saved_patches]}
+            arrays.update((f'patch_{i}', patch['fine']) for i, patch in enumerate(saved_patches))
+        header = {
+            'parameters': self.get_parameters(),
+            'eq_calcium': np.asarray(self.eq_calcium).tolist(),
+            't': self.t,
+            'slow': [self._slow_steps, self._slow_elapsed],
+            'dt_next': self._dt_next,
+            'last_dt': last_dt,
+            'stimuli': stimuli,
+            'patches': patches,
+            'rng': self.rng.bit_generator.state,
+        }
+        return header, arrays
+
+    def save_checkpoint(self, filename):
+        """Write the complete simulation state to one uncompressed binary file.
+
+        The checkpoint holds every state array, the cell geometry, the
+        parameters, the simulated time, the step scheduling state and the
+        random generator state, so restoring it continues the exact trajectory.
+        """
+        header, arrays = self.checkpoint_contents()
+        layout = {}
+        offset = 0
+        for name, array in arrays.items():
+            arrays[name] = array = np.ascontiguousarray(array)
+            layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            offset += _aligned(array.nbytes)
+        header = json.dumps(dict(header, arrays=layout)).encode('utf-8')
+        data_start = _aligned(len(CHECKPOINT_MAGIC) + 8 + len(header))
+
+        # Write beside the target and rename it into place: a model restored
+        # from this path still maps the old file, which must not be truncated
+        temp = f"{filename}.{os.getpid()}.tmp"
+        try:
+            with open(temp, 'wb') as f:
+                f.write(CHECKPOINT_MAGIC)
+                f.write(struct.pack('<Q', len(header)))
+                f.write(header)
+                for name, array in arrays.items():
+                    f.seek(data_start + layout[name]['offset'])
+                    f.write(array.data)
+            os.replace(temp, filename)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    def load_checkpoint(self, filename):
+        """Restore a state written by save_checkpoint.
+
+        The arrays are memory-mapped copy-on-write, so restoring is nearly
+        instant and stepping the model never modifies the checkpoint file.
+        """
+        with open(filename, 'rb') as f:
+            if f.read(len(CHECKPOINT_MAGIC)) != CHECKPOINT_MAGIC:
+                raise ValueError(f"{filename} is not a calcium model checkpoint")
+            (header_size,) = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(header_size).decode('utf-8'))
+        data_start = _aligned(len(CHECKPOINT_MAGIC) + 8 + header_size)
+
+        arrays = {}
+        for name, info in header['arrays'].items():
+            arrays[name] = np.memmap(filename, dtype=np.dtype(info['dtype']), mode='c',
+                                     offset=data_start + info['offset'],
+                                     shape=tuple(info['shape'])).view(np.ndarray)
+
+        # Validate against the header before anything is changed, so a
+        # checkpoint that does not fit leaves the model as it was
+        parameters = header['parameters']
+        ndim = parameters.get('ndim', self.ndim)
+        shape = self.state_shape()[:-self.ndim] + (parameters.get('grid_size', self.grid_size),) * ndim
+        for name in self.state_fields + ('ip3r_open',) + self.geometry_fields:
+            if name not in arrays:
+                raise ValueError(f"Checkpoint {filename} has no '{name}' array")
+        for name in self.state_fields + ('ip3r_open',):
+            if arrays[name].shape != shape:
+                raise ValueError(f"Checkpoint state shape {arrays[name].shape} does not match "
+                                 f"this model ({shape})")
+
+        self.apply_parameters(parameters, f"checkpoint {filename}")
+        self.dtype = np.dtype(self.dtype)
+        self.kernel = self.diffusion_kernel()
+        self.eq_calcium = np.asarray(header['eq_calcium']) if isinstance(header['eq_calcium'], list) \
+            else header['eq_calcium']
+        for name in self.state_fields + ('ip3r_open',) + self.geometry_fields:
+            setattr(self, name, arrays[name])
+        self.t = header['t']
+        self._slow_steps, self._slow_elapsed = header['slow']
+        self._dt_next = header['dt_next']
+        self._last_increments = None
+        if header['last_dt'] is not None:
+            self._last_increments = (header['last_dt'],
+                                     {name: arrays['increment_' + name] for name in self.state_fields})
+        self.stimuli = [stimulus.Stimulus(arrays.get(entry['footprint']) if 'footprint' in entry else None,
+                                          entry['start'], entry['duration'], entry['rate'], entry['end_rate'])
+                        for entry in header.get('stimuli', [])]
+        self.rng.bit_generator.state = header['rng']
+
+        self.patches = refinement.PatchHierarchy(self) if self.refine > 1 else None
+        if self.patches is not None and header.get('patches') is not None:
+            self.patches.restore(([{'rect': tuple(rect), 'fine': arrays[f'patch_{i}']}
+                                   for i, rect in enumerate(header['patches']['rects'])],
+                                  header['patches']['steps']))
+        self.index_compartments()
+        self.index_ip3r_sites()
+        if self.backend == "fused":
+            self.allocate_work_buffers()
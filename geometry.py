@@ -0,0 +1,184 @@
+"""
+Cell geometry generation for the calcium model.
+
+A cell layout (ER, mitochondria, plasma membrane and IP3R clusters) is fully
+determined by (grid_size, ip3r_cluster_density, ip3r_per_cluster, seed) and
+its dimension: ndim=3 gives a volumetric cell on a grid_size**3 grid.
+cell_structure() memoizes layouts under that key in a small in-memory LRU
+cache, and optionally in a directory on disk shared between processes, so
+resets, parameter changes and sweep workers that keep the same cell do not
+regenerate it:
+
+    import geometry
+    geometry.configure_cache(max_entries=32, directory='geometry_cache')
+
+Cached arrays are read-only and shared by every model that uses the layout.
+"""
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+from scipy.ndimage import binary_dilation
+
+# Voxels per ER tubule and per mitochondrion in volumetric layouts, giving
+# about the ER and mitochondrial fractions of a default 2D cell (18% and 2%)
+TUBULE_VOXELS = 2000
+MITOCHONDRION_VOXELS = 8000
+
+_cache = OrderedDict()
+_max_entries = 16
+_directory = None
+
+
+def configure_cache(max_entries=16, directory=None):
+    """Set the in-memory cache size and the optional on-disk cache directory"""
+    global _max_entries, _directory
+    _max_entries = max_entries
+    _directory = directory
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+    while len(_cache) > _max_entries:
+        _cache.popitem(last=False)
+
+
+def clear_cache():
+    """Drop every layout held in memory (the disk cache is left alone)"""
+    _cache.clear()
+
+
+def cell_structure(grid_size, ip3r_cluster_density, ip3r_per_cluster, seed, ndim=2):
+    """Cached (er, mitochondria, pm, ip3r_clusters) layout for the given key"""
+    seed = [int(word) for word in np.atleast_1d(seed)]
+    key = (int(grid_size), float(ip3r_cluster_density), float(ip3r_per_cluster), tuple(seed))
+    # 2D keys keep their original form, so existing disk caches stay valid
+    if ndim != 2:
+        key += (int(ndim),)
+    layout = _cache.get(key)
+    if layout is not None:
+        _cache.move_to_end(key)
+        return layout
+
+    filename = None
+    if _directory is not None:
+        digest = hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+        filename = os.path.join(_directory, f"cell_{digest}.npz")
+        if os.path.exists(filename):
+            with np.load(filename) as data:
+                layout = tuple(data[name] for name in ('er', 'mitochondria', 'pm', 'ip3r_clusters'))
+
+    if layout is None:
+        generate = generate_volume_structure if ndim == 3 else generate_cell_structure
+        layout = generate(grid_size, ip3r_cluster_density, ip3r_per_cluster, seed)
+        if filename is not None:
+            # Write under a temporary name first so concurrent workers never
+            # read a partial file
+            temp = f"{filename}.{os.getpid()}.tmp.npz"
+            np.savez(temp, er=layout[0], mitochondria=layout[1], pm=layout[2], ip3r_clusters=layout[3])
+            os.replace(temp, filename)
+
+    for array in layout:
+        array.setflags(write=False)
+    _cache[key] = layout
+    if len(_cache) > _max_entries:
+        _cache.popitem(last=False)
+    return layout
+
+
+def generate_cell_structure(grid_size, ip3r_cluster_density, ip3r_per_cluster, seed):
+    """Draw a random cell layout, returning (er, mitochondria, pm, ip3r_clusters)"""
+    rng = np.random.default_rng(seed)
+
+    # Create reticulated ER from 50 straight tubules, rasterized together
+    n_tubules = 50
+    start = rng.integers(0, grid_size, (n_tubules, 2))
+    length = rng.integers(20, 50, n_tubules)
+    angle = rng.random(n_tubules) * 2 * np.pi
+    delta = np.stack([(length * np.cos(angle)).astype(int),
+                      (length * np.sin(angle)).astype(int)], axis=1)
+    er = np.zeros((grid_size, grid_size), dtype=bool)
+    er[tuple(_rasterize(start, delta, grid_size).T)] = True
+    er = binary_dilation(er, iterations=2)  # Thicken ER tubules
+
+    # Create 20 mitochondria as 10 x 4 pixel blocks, cropped at the cell edge
+    n_mitochondria = 20
+    corner = rng.integers(0, grid_size, (n_mitochondria, 2))
+    rows = corner[:, 0, np.newaxis, np.newaxis] + np.arange(-5, 5)[:, np.newaxis]
+    cols = corner[:, 1, np.newaxis, np.newaxis] + np.arange(-2, 2)
+    rows, cols = np.broadcast_arrays(rows, cols)
+    inside = (rows >= 0) & (rows < grid_size) & (cols >= 0) & (cols < grid_size)
+    mitochondria = np.zeros((grid_size, grid_size), dtype=bool)
+    mitochondria[rows[inside], cols[inside]] = True
+
+    # Create plasma membrane
+    pm = np.zeros((grid_size, grid_size), dtype=bool)
+    pm[0, :] = pm[-1, :] = pm[:, 0] = pm[:, -1] = True
+
+    return er, mitochondria, pm, _place_clusters(rng, er, ip3r_cluster_density, ip3r_per_cluster)
+
+
+def generate_volume_structure(grid_size, ip3r_cluster_density, ip3r_per_cluster, seed):
+    """Draw a random volumetric cell layout on a grid_size**3 grid, indexed (z, y, x).
+
+    The ER is a reticulum of straight tubules in random 3D directions and the
+    mitochondria are 10 x 4 x 4 voxel blocks along a random axis. Both are
+    drawn at a fixed number per voxel (TUBULE_VOXELS, MITOCHONDRION_VOXELS),
+    with at least as many as a 2D layout, so their volume fractions do not
+    depend on the grid size. Returns (er, mitochondria, pm, ip3r_clusters).
+    """
+    rng = np.random.default_rng(seed)
+    shape = (grid_size,) * 3
+
+    n_tubules = max(50, grid_size**3 // TUBULE_VOXELS)
+    start = rng.integers(0, grid_size, (n_tubules, 3))
+    length = rng.integers(20, 50, n_tubules)
+    # Directions uniform on the sphere
+    cos_polar = rng.uniform(-1, 1, n_tubules)
+    sin_polar = np.sqrt(1 - cos_polar**2)
+    azimuth = rng.random(n_tubules) * 2 * np.pi
+    direction = np.stack([cos_polar, sin_polar * np.cos(azimuth), sin_polar * np.sin(azimuth)], axis=1)
+    delta = (length[:, np.newaxis] * direction).astype(int)
+    er = np.zeros(shape, dtype=bool)
+    er[tuple(_rasterize(start, delta, grid_size).T)] = True
+    er = binary_dilation(er, iterations=2)  # Thicken ER tubules
+
+    n_mitochondria = max(20, grid_size**3 // MITOCHONDRION_VOXELS)
+    corner = rng.integers(0, grid_size, (n_mitochondria, 3))
+    long_axis = rng.integers(0, 3, n_mitochondria)
+    mitochondria = np.zeros(shape, dtype=bool)
+    for axis in range(3):
+        # Voxel offsets of a block lying along this axis, cropped at the cell edge
+        offsets = np.stack(np.meshgrid(*[np.arange(-5, 5) if a == axis else np.arange(-2, 2) for a in range(3)],
+                                       indexing='ij'), axis=-1).reshape(-1, 3)
+        voxels = (corner[long_axis == axis, np.newaxis, :] + offsets).reshape(-1, 3)
+        voxels = voxels[((voxels >= 0) & (voxels < grid_size)).all(axis=1)]
+        mitochondria[tuple(voxels.T)] = True
+
+    # The plasma membrane covers the six faces of the volume
+    pm = np.zeros(shape, dtype=bool)
+    pm[0], pm[-1], pm[:, 0], pm[:, -1], pm[:, :, 0], pm[:, :, -1] = (True,) * 6
+
+    return er, mitochondria, pm, _place_clusters(rng, er, ip3r_cluster_density, ip3r_per_cluster)
+
+
+def _rasterize(start, delta, grid_size):
+    # Grid points along every segment start -> start + delta, rasterized together
+    points = np.abs(delta).max(axis=1) + 1
+    segment = np.repeat(np.arange(len(start)), points)
+    # Position of every point along its segment, from 0 at the start to 1 at the end
+    fraction = (np.arange(points.sum()) - np.repeat(np.cumsum(points) - points, points)) \
+        / np.maximum(np.repeat(points, points) - 1, 1)
+    pixels = np.rint(start[segment] + fraction[:, np.newaxis] * delta[segment]).astype(int)
+    return np.clip(pixels, 0, grid_size - 1)
+
+
+def _place_clusters(rng, er, ip3r_cluster_density, ip3r_per_cluster):
+    # Create IP3R clusters on ER
+    ip3r_clusters = np.zeros(er.shape, dtype=np.int32)
+    er_sites = np.flatnonzero(er)
+    num_clusters = int(len(er_sites) * ip3r_cluster_density)
+    cluster_sites = rng.choice(er_sites, num_clusters, replace=False)
+    ip3r_clusters.flat[cluster_sites] = rng.poisson(ip3r_per_cluster, num_clusters)
+    return ip3r_clusters
@@ -6,14 +6,33 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QH
                              QDockWidget, QTabWidget, QMenuBar, QMenu, QAction, QInputDialog, QFileDialog,
                              QMessageBox)
 from PyQt5.QtCore import QTimer, Qt
+from PyQt5.QtGui import QFontDatabase
 import pyqtgraph as pg
 import os
 import json
+from recorder import TrajectoryRecorder
+from runner import SimulationRunner
+from profiling import StepProfiler
+from observables import Observables
+from events import EventDetector
+import stimulus
 
 class MainWindow(QMainWindow):
     def __init__(self, calcium_model):
         super().__init__()
         self.calcium_model = calcium_model
+        self.recorder = None
+        # Future of a steady-state solve running on the runner's worker
+        self.steady_state_solve = None
+        # The model is advanced on a worker thread; the display timer only
+        # pulls the newest frame from it
+        self.runner = SimulationRunner(calcium_model)
+        # Whole-cell and ROI traces, sampled inside step() for the trace plot
+        self.observables = Observables(capacity=20000).add_standard()
+        calcium_model.callbacks.append(self.observables)
+        # Online Ca2+ release event detection, shown as markers on the cytosol view
+        self.event_detector = EventDetector()
+        calcium_model.callbacks.append(self.event_detector)
         self.initUI()
 
         self.cell_states = {
@@ -76,6 +95,15 @@ class MainWindow(QMainWindow):
         # Cell feature overlay
         self.feature_overlay = pg.ImageItem()
         self.calcium_view.view.addItem(self.feature_overlay)
+        self.event_markers = pg.ScatterPlotItem(size=12, pen=pg.mkPen('m', width=2), brush=None)
+        self.calcium_view.view.addItem(self.event_markers)
+
+        # Rendering state: only the visible tab is drawn, from the last frame,
+        # into image buffers that are reused while the grid size is unchanged
+        self.frame = None
+        self.image_buffers = {}
+        self.overlay_sources = None
+        self.tab_widget.currentChanged.connect(lambda: self.update_view(self.frame))
 
         # Create docks
         self.create_control_dock()
@@ -84,11 +112,13 @@ class MainWindow(QMainWindow):
         self.create_buffer_dock()
         self.create_ip3_uncaging_dock()
         self.create_feature_visibility_dock()
+        self.create_profiling_dock()
+        self.create_traces_dock()
 
         # Create menu bar
         self.create_menu_bar()
 
-        # Set up timer for simulation updates
+        # Set up timer for display updates
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_simulation)
         self.timer.setInterval(50)  # 50 ms, 20 fps
@@ -102,6 +132,26 @@ class MainWindow(QMainWindow):
         self.start_button.clicked.connect(self.toggle_simulation)
         layout.addWidget(self.start_button)
 
+        speed_group = QGroupBox("Speed")
+        speed_layout = QFormLayout(speed_group)
+
+        self.steps_per_frame = QSpinBox()
+        self.steps_per_frame.setRange(1, 10000)
+        self.steps_per_frame.setValue(self.runner.steps_per_frame)
+        self.steps_per_frame.valueChanged.connect(self.set_speed)
+        speed_layout.addRow("Steps per Frame:", self.steps_per_frame)
+
+        self.realtime_factor = QDoubleSpinBox()
+        self.realtime_factor.setRange(0, 100)
+        self.realtime_factor.setDecimals(3)
+        self.realtime_factor.setSingleStep(0.01)
+        self.realtime_factor.setSpecialValueText("Unlimited")
+        self.realtime_factor.setValue(self.runner.realtime_factor or 0)
+        self.realtime_factor.valueChanged.connect(self.set_speed)
+        speed_layout.addRow("Realtime Factor:", self.realtime_factor)
+
+        layout.addWidget(speed_group)
+
         initial_group = QGroupBox("Initial Conditions")
         initial_layout = QFormLayout(initial_group)
 
@@ -152,6 +202,11 @@ class MainWindow(QMainWindow):
         self.ip3r_per_cluster.setValue(self.calcium_model.ip3r_per_cluster)
         layout.addRow("IP3Rs per Cluster:", self.ip3r_per_cluster)
 
+        self.geometry_seed = QSpinBox()
+        self.geometry_seed.setRange(0, 2**31 - 1)
+        self.geometry_seed.setValue(self.calcium_model.geometry_seed)
+        layout.addRow("Cell Geometry Seed:", self.geometry_seed)
+
         self.ip3r_open_rate = QDoubleSpinBox()
         self.ip3r_open_rate.setRange(0, 1)
         self.ip3r_open_rate.setSingleStep(0.01)
@@ -164,6 +219,11 @@ class MainWindow(QMainWindow):
         self.ip3r_close_rate.setValue(self.calcium_model.ip3r_close_rate)
         layout.addRow("IP3R Close Rate:", self.ip3r_close_rate)
 
+        self.ip3r_gating = QComboBox()
+        self.ip3r_gating.addItems(["uniform", "binomial"])
+        self.ip3r_gating.setCurrentText(self.calcium_model.gating)
+        layout.addRow("Gating Engine:", self.ip3r_gating)
+
         dock.setWidget(widget)
         self.addDockWidget(Qt.LeftDockWidgetArea, dock)
 
@@ -184,6 +244,31 @@ class MainWindow(QMainWindow):
         self.d_ip3.setValue(self.calcium_model.D_ip3)
         layout.addRow("IP3 Diffusion Coefficient:", self.d_ip3)
 
+        self.diffusion_solver = QComboBox()
+        self.diffusion_solver.addItems(["explicit", "implicit"])
+        self.diffusion_solver.setCurrentText(self.calcium_model.diffusion)
+        layout.addRow("Diffusion Solver:", self.diffusion_solver)
+
+        self.precision = QComboBox()
+        self.precision.addItems(["float64", "float32"])
+        self.precision.setCurrentText(self.calcium_model.dtype.name)
+        layout.addRow("Precision:", self.precision)
+
+        self.buffer_substeps = QSpinBox()
+        self.buffer_substeps.setRange(1, 1000)
+        self.buffer_substeps.setValue(self.calcium_model.buffer_substeps)
+        layout.addRow("Buffer Substeps:", self.buffer_substeps)
+
+        self.ip3_substeps = QSpinBox()
+        self.ip3_substeps.setRange(1, 1000)
+        self.ip3_substeps.setValue(self.calcium_model.ip3_substeps)
+        layout.addRow("IP3 Diffusion Substeps:", self.ip3_substeps)
+
+        self.slow_interval = QSpinBox()
+        self.slow_interval.setRange(1, 1000)
+        self.slow_interval.setValue(self.calcium_model.slow_interval)
+        layout.addRow("Slow Update Interval:", self.slow_interval)
+
         self.leak_rate = QDoubleSpinBox()
         self.leak_rate.setRange(0, 1)
         self.leak_rate.setSingleStep(0.0001)
@@ -298,24 +383,144 @@ class MainWindow(QMainWindow):
         layout = QVBoxLayout(widget)
 
         self.show_ip3r = QCheckBox("Show IP3 Receptors")
-        self.show_ip3r.stateChanged.connect(self.update_view)
+        self.show_ip3r.stateChanged.connect(lambda: self.update_view())
         layout.addWidget(self.show_ip3r)
 
         self.show_er = QCheckBox("Show ER")
-        self.show_er.stateChanged.connect(self.update_view)
+        self.show_er.stateChanged.connect(lambda: self.update_view())
         layout.addWidget(self.show_er)
 
         self.show_mito = QCheckBox("Show Mitochondria")
-        self.show_mito.stateChanged.connect(self.update_view)
+        self.show_mito.stateChanged.connect(lambda: self.update_view())
         layout.addWidget(self.show_mito)
 
         self.show_pm = QCheckBox("Show Plasma Membrane")
-        self.show_pm.stateChanged.connect(self.update_view)
+        self.show_pm.stateChanged.connect(lambda: self.update_view())
         layout.addWidget(self.show_pm)
 
+        self.show_events = QCheckBox("Show Release Events")
+        self.show_events.stateChanged.connect(lambda: self.update_view())
+        layout.addWidget(self.show_events)
+
         dock.setWidget(widget)
         self.addDockWidget(Qt.RightDockWidgetArea, dock)
 
+    def create_profiling_dock(self):
+        dock = QDockWidget("Step Profiling", self)
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+
+        self.profile_enabled = QCheckBox("Profile step()")
+        self.profile_enabled.stateChanged.connect(self.toggle_profiling)
+        layout.addWidget(self.profile_enabled)
+
+        self.profile_fluxes = QCheckBox("Record Flux Magnitudes")
+        self.profile_fluxes.stateChanged.connect(self.toggle_flux_recording)
+        layout.addWidget(self.profile_fluxes)
+
+        self.profile_report = QLabel("Profiling is off")
+        self.profile_report.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        layout.addWidget(self.profile_report)
+
+        buttons = QHBoxLayout()
+        reset_button = QPushButton("Reset")
+        reset_button.clicked.connect(self.reset_profiling)
+        buttons.addWidget(reset_button)
+        export_button = QPushButton("Export Trace...")
+        export_button.clicked.connect(self.export_profiling_trace)
+        buttons.addWidget(export_button)
+        layout.addLayout(buttons)
+
+        dock.setWidget(widget)
+        self.addDockWidget(Qt.RightDockWidgetArea, dock)
+
+    def toggle_profiling(self):
+        profiler = None
+        if self.profile_enabled.isChecked():
+            profiler = StepProfiler(fluxes=self.profile_fluxes.isChecked(), trace=True)
+        with self.runner.lock:
+            self.calcium_model.profiler = profiler
+        self.update_profiling_report()
+
+    def toggle_flux_recording(self):
+        # Switch flux recording on the running profiler, keeping its timings
+        profiler = self.calcium_model.profiler
+        if profiler is not None:
+            profiler.fluxes = self.profile_fluxes.isChecked()
+
+    def reset_profiling(self):
+        if self.calcium_model.profiler is not None:
+            self.calcium_model.profiler.reset()
+        self.update_profiling_report()
+
+    def export_profiling_trace(self):
+        if self.calcium_model.profiler is None:
+            QMessageBox.information(self, 'Export Trace', 'Enable profiling and run the simulation first.')
+            return
+        filename, _ = QFileDialog.getSaveFileName(self, 'Export Trace', '', 'Chrome Traces (*.json)')
+        if filename:
+            self.calcium_model.profiler.export_trace(filename)
+
+    def update_profiling_report(self):
+        profiler = self.calcium_model.profiler
+        self.profile_report.setText(profiler.report() if profiler is not None else "Profiling is off")
+
+    def create_traces_dock(self):
+        dock = QDockWidget("Traces", self)
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+
+        self.trace_selector = QComboBox()
+        self.trace_selector.addItems(self.observables.names)
+        self.trace_selector.currentIndexChanged.connect(self.update_traces)
+        layout.addWidget(self.trace_selector)
+
+        self.trace_plot = pg.PlotWidget()
+        self.trace_plot.setLabel('bottom', 'Time (s)')
+        self.trace_curve = self.trace_plot.plot(pen='y')
+        layout.addWidget(self.trace_plot)
+
+        buttons = QHBoxLayout()
+        roi_button = QPushButton("Add ROI at Uncaging Spot")
+        roi_button.clicked.connect(self.add_trace_roi)
+        buttons.addWidget(roi_button)
+        clear_button = QPushButton("Clear")
+        clear_button.clicked.connect(self.clear_traces)
+        buttons.addWidget(clear_button)
+        layout.addLayout(buttons)
+
+        dock.setWidget(widget)
+        self.addDockWidget(Qt.BottomDockWidgetArea, dock)
+
+    def add_trace_roi(self):
+        # Mean cytosolic Ca2+ in the disk set by the IP3 uncaging position and radius
+        x, y, radius = self.ip3_x.value(), self.ip3_y.value(), self.ip3_radius.value()
+        name = f"calcium_roi_{x}_{y}_{radius}"
+        with self.runner.lock:
+            self.observables.add(name, 'calcium', roi=stimulus.disk(self.calcium_model.grid_size, x, y, radius))
+        if self.trace_selector.findText(name) < 0:
+            self.trace_selector.addItem(name)
+        self.trace_selector.setCurrentText(name)
+
+    def clear_traces(self):
+        with self.runner.lock:
+            self.observables.clear()
+        self.update_traces()
+
+    def clear_analysis(self):
+        # Traces and events start over with a new simulation state
+        with self.runner.lock:
+            self.observables.clear()
+            self.event_detector.clear()
+        self.update_traces()
+
+    def update_traces(self):
+        name = self.trace_selector.currentText()
+        if name:
+            times, values = self.observables.trace(name)
+            self.trace_curve.setData(times, values)
+            self.trace_plot.setLabel('left', name)
+
     def create_menu_bar(self):
         menubar = self.menuBar()
 
@@ -330,6 +535,22 @@ class MainWindow(QMainWindow):
         load_action.triggered.connect(self.load_parameters)
         file_menu.addAction(load_action)
 
+        save_sim_action = QAction('Save Simulation...', self)
+        save_sim_action.triggered.connect(self.save_simulation)
+        file_menu.addAction(save_sim_action)
+
+        load_sim_action = QAction('Load Simulation...', self)
+        load_sim_action.triggered.connect(self.load_simulation)
+        file_menu.addAction(load_sim_action)
+
+        export_events_action = QAction('Export Events...', self)
+        export_events_action.triggered.connect(self.export_events)
+        file_menu.addAction(export_events_action)
+
+        self.record_action = QAction('Start Recording...', self)
+        self.record_action.triggered.connect(self.toggle_recording)
+        file_menu.addAction(self.record_action)
+
         exit_action = QAction('Exit', self)
         exit_action.setShortcut('Ctrl+Q')
         exit_action.triggered.connect(self.close)
@@ -358,13 +579,53 @@ class MainWindow(QMainWindow):
         reset_action.triggered.connect(self.reset_simulation)
         sim_menu.addAction(reset_action)
 
+        steady_action = QAction('Relax to Steady State', self)
+        steady_action.triggered.connect(self.relax_to_steady_state)
+        sim_menu.addAction(steady_action)
+
     def save_simulation(self):
-        # TODO: Implement save functionality
-        pass
+        filename, _ = QFileDialog.getSaveFileName(self, 'Save Simulation', '', 'Checkpoints (*.ckpt)')
+        if filename:
+            with self.runner.lock:
+                self.calcium_model.save_checkpoint(filename)
 
     def load_simulation(self):
-        # TODO: Implement load functionality
-        pass
+        filename, _ = QFileDialog.getOpenFileName(self, 'Load Simulation', '', 'Checkpoints (*.ckpt)')
+        if filename:
+            try:
+                with self.runner.lock:
+                    self.calcium_model.load_checkpoint(filename)
+            except ValueError as e:
+                QMessageBox.warning(self, 'Load Simulation', str(e))
+                return
+            self.clear_analysis()
+            self.update_view()
+
+    def export_events(self):
+        filename, _ = QFileDialog.getSaveFileName(self, 'Export Events', '', 'CSV Files (*.csv)')
+        if filename:
+            self.event_detector.save(filename)
+
+    def toggle_recording(self):
+        if self.recorder is None:
+            path, _ = QFileDialog.getSaveFileName(self, 'Record Trajectory', '', 'Trajectory Stores (*.traj)')
+            if path:
+                self.recorder = TrajectoryRecorder(path)
+                with self.runner.lock:
+                    self.calcium_model.callbacks.append(self.recorder)
+                self.record_action.setText('Stop Recording')
+        else:
+            with self.runner.lock:
+                self.calcium_model.callbacks.remove(self.recorder)
+            self.recorder.close()
+            self.recorder = None
+            self.record_action.setText('Start Recording...')
+
+    def closeEvent(self, event):
+        self.runner.stop()
+        if self.recorder is not None:
+            self.toggle_recording()
+        super().closeEvent(event)
 
     def toggle_calcium_view(self):
         self.calcium_view.setVisible(not self.calcium_view.isVisible())
@@ -372,47 +633,119 @@ class MainWindow(QMainWindow):
     def toggle_ip3_view(self):
         self.ip3_view.setVisible(not self.ip3_view.isVisible())
 
-    def update_view(self):
-        # Update calcium views
-        self.calcium_view.setImage(self.calcium_model.calcium.T, autoLevels=False)
-        self.er_calcium_view.setImage(self.calcium_model.er_calcium.T * self.calcium_model.er.T, autoLevels=False)
-        self.mito_calcium_view.setImage(self.calcium_model.mito_calcium.T * self.calcium_model.mitochondria.T, autoLevels=False)
-        self.ip3_view.setImage(self.calcium_model.ip3_conc.T, autoLevels=False)
-
-        # Create feature overlay
-        overlay = np.zeros((*self.calcium_model.calcium.shape, 4), dtype=np.uint8)
-
-        if self.show_ip3r.isChecked():
-            overlay[self.calcium_model.ip3r_clusters > 0] = [255, 0, 0, 100]  # Red for closed IP3Rs
-            overlay[self.calcium_model.ip3r_open > 0] = [0, 255, 0, 100]  # Green for open IP3Rs
-
-        if self.show_er.isChecked():
-            overlay[self.calcium_model.er == 1] = [0, 255, 0, 100]  # Green for ER
-
-        if self.show_mito.isChecked():
-            overlay[self.calcium_model.mitochondria == 1] = [0, 0, 255, 100]  # Blue for mitochondria
-
-        if self.show_pm.isChecked():
-            overlay[self.calcium_model.pm == 1] = [255, 255, 0, 100]  # Yellow for plasma membrane
-
+    def update_view(self, frame=None):
+        # Show a frame pulled from the runner, or the current model state
+        # (the last frame while a steady-state solve holds the model)
+        if frame is None:
+            if self.steady_state_solve is not None:
+                frame = self.frame
+                if frame is None:
+                    return
+            else:
+                frame = self.runner.capture()
+        self.frame = frame
+
+        # Only the visible tab is redrawn; the others catch up when selected
+        tab = self.tab_widget.currentIndex()
+        if tab == 0:
+            self.calcium_view.setImage(frame['calcium'].T, autoLevels=False)
+            self.update_overlay(frame)
+            self.update_event_markers()
+        elif tab == 1:
+            masked = self.image_buffer('er_calcium', frame['er_calcium'].shape)
+            np.multiply(frame['er_calcium'], self.calcium_model.er, out=masked)
+            self.er_calcium_view.setImage(masked.T, autoLevels=False)
+        elif tab == 2:
+            masked = self.image_buffer('mito_calcium', frame['mito_calcium'].shape)
+            np.multiply(frame['mito_calcium'], self.calcium_model.mitochondria, out=masked)
+            self.mito_calcium_view.setImage(masked.T, autoLevels=False)
+        elif tab == 3:
+            self.ip3_view.setImage(frame['ip3_conc'].T, autoLevels=False)
+
+    def update_event_markers(self):
+        # Circles at the centroids of the ongoing release events
+        if self.show_events.isChecked():
+            centroids = [centroid for centroid, _ in self.event_detector.active()]
+            self.event_markers.setData([col + 0.5 for _, col in centroids],
+                                       [row + 0.5 for row, _ in centroids])
+        else:
+            self.event_markers.setData([], [])
+
+    def image_buffer(self, name, shape, dtype=np.float64):
+        buffer = self.image_buffers.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = self.image_buffers[name] = np.zeros(shape, dtype=dtype)
+        return buffer
+
+    def update_overlay(self, frame):
+        # The ER, mitochondria and plasma membrane layers are static, so they
+        # are composed once into a cached base layer (rebuilt when the geometry
+        # or the visible layers change). Each frame only repaints the IP3R
+        # sites not covered by a static layer, which take precedence
+        model = self.calcium_model
+        show = (self.show_ip3r.isChecked(), self.show_er.isChecked(),
+                self.show_mito.isChecked(), self.show_pm.isChecked())
+        sources = (model.er, model.mitochondria, model.pm, model.ip3r_sites) + show
+        overlay = self.image_buffer('overlay', (*frame['calcium'].shape, 4), np.uint8)
+        if self.overlay_sources is None or any(a is not b for a, b in zip(sources, self.overlay_sources)):
+            base = self.image_buffer('overlay_base', overlay.shape, np.uint8)
+            base[...] = 0
+            if show[1]:
+                base[model.er == 1] = [0, 255, 0, 100]  # Green for ER
+            if show[2]:
+                base[model.mitochondria == 1] = [0, 0, 255, 100]  # Blue for mitochondria
+            if show[3]:
+                base[model.pm == 1] = [255, 255, 0, 100]  # Yellow for plasma membrane
+            overlay[...] = base
+            self.overlay_ip3r_sites = model.ip3r_sites[base.reshape(-1, 4)[model.ip3r_sites, 3] == 0]
+            self.overlay_sources = sources
+
+        if show[0]:
+            sites = self.overlay_ip3r_sites
+            open_sites = frame['ip3r_open'].flat[sites] > 0
+            # Green for open IP3Rs, red for closed IP3Rs
+            overlay.reshape(-1, 4)[sites] = np.where(open_sites[:, np.newaxis],
+                                                     [0, 255, 0, 100], [255, 0, 0, 100])
         self.feature_overlay.setImage(overlay.transpose(1, 0, 2))
 
     def toggle_simulation(self):
         if self.timer.isActive():
-            self.timer.stop()
-            self.start_button.setText("Start")
+            self.stop_simulation()
         else:
+            self.runner.start()
             self.timer.start()
             self.start_button.setText("Stop")
 
-    def update_simulation(self):
-        self.calcium_model.step()
+    def stop_simulation(self):
+        self.runner.stop()
+        self.timer.stop()
+        self.start_button.setText("Start")
         self.update_view()
 
+    def update_simulation(self):
+        # Display tick: show the newest frame if the runner has produced one
+        # since the last tick (frames in between are dropped)
+        if self.runner.error is not None:
+            error = self.runner.error
+            self.stop_simulation()
+            QMessageBox.warning(self, 'Simulation Error', str(error))
+            return
+        frame = self.runner.frame()
+        if frame is not None:
+            self.update_view(frame)
+            self.update_traces()
+            if self.calcium_model.profiler is not None:
+                self.update_profiling_report()
+
+    def set_speed(self):
+        self.runner.steps_per_frame = self.steps_per_frame.value()
+        self.runner.realtime_factor = self.realtime_factor.value() or None
+
     def add_global_ip3(self):
         amount = self.ip3_amount.value()
         duration = self.ip3_duration.value()
-        self.calcium_model.add_ip3_global(amount, duration)
+        with self.runner.lock:
+            self.calcium_model.add_ip3_global(amount, duration)
 
     def add_local_ip3(self):
         x = self.ip3_x.value()
@@ -420,54 +753,99 @@ class MainWindow(QMainWindow):
         radius = self.ip3_radius.value()
         amount = self.ip3_amount.value()
         duration = self.ip3_duration.value()
-        self.calcium_model.add_ip3_local(x, y, radius, amount, duration)
+        with self.runner.lock:
+            self.calcium_model.add_ip3_local(x, y, radius, amount, duration)
 
     def apply_settings(self):
-        # Update initial conditions
-        self.calcium_model.initial_calcium = self.initial_calcium.value()
-        self.calcium_model.initial_er_calcium = self.initial_er_calcium.value()
-        self.calcium_model.initial_ip3 = self.initial_ip3.value()
-
-        # Update IP3R parameters
-        self.calcium_model.ip3r_cluster_density = self.ip3r_cluster_density.value()
-        self.calcium_model.ip3r_per_cluster = self.ip3r_per_cluster.value()
-        self.calcium_model.ip3r_open_rate = self.ip3r_open_rate.value()
-        self.calcium_model.ip3r_close_rate = self.ip3r_close_rate.value()
-
-        # Update other parameters
-        self.calcium_model.D_ca = self.d_ca.value()
-        self.calcium_model.D_ip3 = self.d_ip3.value()
-        self.calcium_model.leak_rate = self.leak_rate.value()
-        self.calcium_model.serca_rate = self.serca_rate.value()
-        self.calcium_model.serca_k = self.serca_k.value()
-        self.calcium_model.ip3_degradation_rate = self.ip3_degradation_rate.value()
-        self.calcium_model.pmca_rate = self.pmca_rate.value()
-        self.calcium_model.mcu_rate = self.mcu_rate.value()
-
-        # Update buffer conditions
-        self.calcium_model.set_buffer_conditions(
-            self.buffer_total.value(),
-            self.buffer_kd.value(),
-            self.buffer_kon.value()
-        )
-
-        # Recalculate equilibrium
-        self.calcium_model.eq_calcium = self.calcium_model.calculate_equilibrium_calcium()
-
-        # Reset the simulation with new parameters
-        self.calcium_model.reset()
-        self.calcium_model.create_cell_structure()
+        with self.runner.lock:
+            # Update initial conditions
+            self.calcium_model.initial_calcium = self.initial_calcium.value()
+            self.calcium_model.initial_er_calcium = self.initial_er_calcium.value()
+            self.calcium_model.initial_ip3 = self.initial_ip3.value()
+
+            # Update IP3R parameters
+            self.calcium_model.ip3r_cluster_density = self.ip3r_cluster_density.value()
+            self.calcium_model.ip3r_per_cluster = self.ip3r_per_cluster.value()
+            self.calcium_model.geometry_seed = self.geometry_seed.value()
+            self.calcium_model.ip3r_open_rate = self.ip3r_open_rate.value()
+            self.calcium_model.ip3r_close_rate = self.ip3r_close_rate.value()
+            self.calcium_model.gating = self.ip3r_gating.currentText()
+
+            # Update other parameters
+            self.calcium_model.D_ca = self.d_ca.value()
+            self.calcium_model.D_ip3 = self.d_ip3.value()
+            self.calcium_model.diffusion = self.diffusion_solver.currentText()
+            self.calcium_model.dtype = self.precision.currentText()
+            self.calcium_model.buffer_substeps = self.buffer_substeps.value()
+            self.calcium_model.ip3_substeps = self.ip3_substeps.value()
+            self.calcium_model.slow_interval = self.slow_interval.value()
+            self.calcium_model.leak_rate = self.leak_rate.value()
+            self.calcium_model.serca_rate = self.serca_rate.value()
+            self.calcium_model.serca_k = self.serca_k.value()
+            self.calcium_model.ip3_degradation_rate = self.ip3_degradation_rate.value()
+            self.calcium_model.pmca_rate = self.pmca_rate.value()
+            self.calcium_model.mcu_rate = self.mcu_rate.value()
+
+            # Update buffer conditions
+            self.calcium_model.set_buffer_conditions(
+                self.buffer_total.value(),
+                self.buffer_kd.value(),
+                self.buffer_kon.value()
+            )
+
+            # Recalculate equilibrium
+            self.calcium_model.eq_calcium = self.calcium_model.calculate_equilibrium_calcium()
+
+            # Reset the simulation with new parameters
+            self.calcium_model.reset()
+            self.calcium_model.create_cell_structure()
+            self.clear_analysis()
 
         # Update the view
         self.update_view()
 
     def reset_simulation(self):
-        self.calcium_model.reset()
-        self.calcium_model.create_cell_structure()
-        self.update_view()
         if self.timer.isActive():
-            self.timer.stop()
-            self.start_button.setText("Start")
+            self.stop_simulation()
+        with self.runner.lock:
+            self.calcium_model.reset()
+            self.calcium_model.create_cell_structure()
+            self.clear_analysis()
+        self.update_view()
+
+    def relax_to_steady_state(self):
+        # The solve can take seconds on a large grid, so it runs on the
+        # runner's worker and is polled from here
+        if self.steady_state_solve is not None:
+            return
+        self.statusBar().showMessage("Solving for the steady state...")
+        self.steady_state_solve = self.runner.submit(self.calcium_model.steady_state)
+        # The solver holds the runner lock: every control that changes or
+        # captures the model would block the UI until it finishes
+        self.set_controls_enabled(False)
+        QTimer.singleShot(100, self.check_steady_state)
+
+    def check_steady_state(self):
+        solve = self.steady_state_solve
+        if not solve.done():
+            QTimer.singleShot(100, self.check_steady_state)
+            return
+        self.steady_state_solve = None
+        self.set_controls_enabled(True)
+        try:
+            residual = solve.result()
+        except Exception as e:
+            QMessageBox.warning(self, 'Steady State Error', str(e))
+            return
+        self.statusBar().showMessage(f"Steady state residual: {residual:.2e}")
+        self.update_view()
+
+    def set_controls_enabled(self, enabled):
+        # Menu actions are disabled too, so their shortcuts stop as well
+        for action in self.menuBar().findChildren(QAction):
+            action.setEnabled(enabled)
+        for dock in self.findChildren(QDockWidget):
+            dock.setEnabled(enabled)
 
     def create_cell_state_menu(self):
         cell_state_menu = self.menuBar().addMenu('Cell States')
@@ -487,7 +865,9 @@ class MainWindow(QMainWindow):
     def load_cell_state(self, state_name):
         filename = self.cell_states[state_name]
         if os.path.exists(filename):
-            self.calcium_model.load_parameters(filename)
+            with self.runner.lock:
+                self.calcium_model.load_parameters(filename)
+                self.clear_analysis()
             self.update_view()
         else:
             QMessageBox.warning(self, "File Not Found", f"The file {filename} does not exist.")
@@ -516,7 +896,9 @@ class MainWindow(QMainWindow):
     def load_parameters(self):
         filename, _ = QFileDialog.getOpenFileName(self, 'Load Parameters', '', 'JSON Files (*.json)')
         if filename:
-            self.calcium_model.load_parameters(filename)
+            with self.runner.lock:
+                self.calcium_model.load_parameters(filename)
+                self.clear_analysis()
             self.update_view()
 
     def create_default_states(self):
@@ -0,0 +1,210 @@
+"""
+Scalar traces of the calcium model computed while it runs.
+
+An Observables set is attached to a model through model.callbacks and reduces
+registered fields to a few numbers every `stride` steps: the mean, sum,
+maximum or minimum of a field over the whole cell, over a compartment ('er',
+'mitochondria', 'pm', 'ip3r') or over a region of interest given as a boolean
+grid (or volume, for a 3D cell) or flat pixel indices. ROI index sets are
+resolved once and reused. Samples go into fixed-size ring buffers and can
+also be streamed to a CSV file, so a long run keeps kilobytes of traces
+instead of full grids:
+
+    obs = Observables(capacity=100000, stride=10, stream='traces.csv')
+    obs.add_standard()
+    obs.add('spot_calcium', 'calcium', roi=stimulus.disk(model.grid_size, 100, 100, 5))
+    model.callbacks.append(obs)
+    model.advance(60.0)
+    obs.close()
+    t, calcium = obs.trace('calcium_mean')
+
+For an ensemble every observable has one value per replicate.
+"""
+
+import threading
+
+import numpy as np
+
+REDUCTIONS = ('mean', 'sum', 'max', 'min')
+
+# Compartment ROIs and the model's flat site indices they use
+COMPARTMENTS = {'er': 'er_sites', 'mitochondria': 'mito_sites', 'pm': 'pm_sites', 'ip3r': 'ip3r_sites'}
+
+# (name, field, reduction, roi) of the whole-cell traces added by add_standard()
+STANDARD = (
+    ('calcium_mean', 'calcium', 'mean', None),
+    ('calcium_max', 'calcium', 'max', None),
+    ('er_calcium_mean', 'er_calcium', 'mean', 'er'),
+    ('mito_calcium_mean', 'mito_calcium', 'mean', 'mitochondria'),
+    ('ip3_mean', 'ip3_conc', 'mean', None),
+    ('open_ip3r', 'ip3r_open', 'sum', None),
+)
+
+
+class Observables:
+    """Registered reductions of model fields, sampled into ring buffers"""
+
+    def __init__(self, capacity=10000, stride=1, stream=None):
+        self.capacity = capacity
+        self.stride = stride
+        self.stream = stream
+        self.names = []
+        self.n_samples = 0
+        # Held while a sample is stored, so traces can be read from another thread
+        self.lock = threading.Lock()
+        self._specs = {}
+        self._index = {}
+        self._times = np.empty(capacity)
+        self._values = {}
+        self._steps = 0
+        self._file = None
+
+    def add(self, name, field, reduction='mean', roi=None):
+        """Register trace `name`: `reduction` of model field `field` over `roi`"""
+        if reduction not in REDUCTIONS:
+            raise ValueError(f"Unknown reduction '{reduction}', expected one of {', '.join(REDUCTIONS)}")
+        if isinstance(roi, str) and roi not in COMPARTMENTS:
+            raise ValueError(f"Unknown compartment '{roi}', expected one of {', '.join(COMPARTMENTS)}")
+        if self._file is not None:
+            raise ValueError("Observables cannot be added once streaming has started")
+        if name not in self._specs:
+            self.names.append(name)
+        self._specs[name] = (field, reduction, roi)
+        self._index.pop(name, None)
+        self._values.pop(name, None)
+        return self
+
+    def add_standard(self):
+        """Register the whole-cell traces listed in STANDARD"""
+        for spec in STANDARD:
+            self.add(*spec)
+        return self
+
+    def __call__(self, model):
+        """Model callback: sample every `stride` steps"""
+        if self._steps % self.stride == 0:
+            self.sample(model)
+        self._steps += 1
+
+    def sample(self, model):
+        """Evaluate every observable on the current state of `model`"""
+        self._store(model.t, {name: self._reduce(model, name) for name in self.names})
+
+    def trace(self, name):
+        """(times, values) of the samples still in the ring buffer, oldest first"""
+        with self.lock:
+            count = min(self.n_samples, self.capacity)
+            order = np.arange(self.n_samples - count, self.n_samples) % self.capacity
+            buffer = self._values.get(name)
+            values = buffer[order] if buffer is not None else np.full(count, np.nan)
+            return self._times[order], values
+
+    def latest(self):
+        """{name: value} of the most recent sample"""
+        with self.lock:
+            if not self.n_samples:
+                return {}
+            slot = (self.n_samples - 1) % self.capacity
+            return {name: buffer[slot].copy() for name, buffer in self._values.items()}
+
+    def export(self, since=0):
+        """(times, {name: values}) of the samples numbered `since` onwards still in the ring buffer"""
+        with self.lock:
+            first = max(since, self.n_samples - self.capacity)
+            order = np.arange(first, self.n_samples) % self.capacity
+            values = {name: buffer[order] for name, buffer in self._values.items()}
+            return self._times[order], values
+
+    def extend(self, times, values, steps=0):
+        """Append samples recorded elsewhere (e.g. a cached run) as if taken
+        here, advancing the stride count by the `steps` they covered"""
+        for i, t in enumerate(times):
+            self._store(float(t), {name: values[name][i] for name in self.names})
+        self._steps += steps
+
+    def clear(self):
+        """Drop all samples (the registered observables are kept)"""
+        with self.lock:
+            self.n_samples = 0
+            self._steps = 0
+            self._values = {}
+
+    def close(self):
+        """Close the stream file"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self.stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _store(self, t, values):
+        with self.lock:
+            slot = self.n_samples % self.capacity
+            self._times[slot] = t
+            for name, value in values.items():
+                buffer = self._values.get(name)
+                if buffer is None:
+                    buffer = self._values[name] = np.full((self.capacity,) + np.shape(value), np.nan)
+                buffer[slot] = value
+            self.n_samples += 1
+        if self.stream is not None:
+            self._write(t, values)
+
+    def _reduce(self, model, name):
+        field, reduction, roi = self._specs[name]
+        values = getattr(model, field)
+        spatial = getattr(model, 'ndim', 2)
+        n = int(np.prod(values.shape[:-spatial], dtype=int))
+        if roi is None:
+            result = getattr(values.reshape(n, -1), reduction)(axis=1)
+        else:
+            sites, starts = self._roi_index(model, name, roi, values.shape, spatial)
+            picked = values.ravel()[sites]
+            counts = np.diff(np.append(starts, len(sites)))
+            if len(sites) == 0:
+                result = np.full(n, 0.0 if reduction == 'sum' else np.nan)
+            else:
+                ufunc = {'mean': np.add, 'sum': np.add, 'max': np.maximum, 'min': np.minimum}[reduction]
+                result = ufunc.reduceat(picked, np.minimum(starts, len(sites) - 1)).astype(np.float64)
+                if reduction == 'mean':
+                    result = result / np.maximum(counts, 1)
+                # reduceat returns an element instead of the identity for empty groups
+                result[counts == 0] = 0.0 if reduction == 'sum' else np.nan
+        result = np.asarray(result, dtype=np.float64)
+        return float(result[0]) if values.ndim == spatial else result
+
+    def _roi_index(self, model, name, roi, shape, spatial):
+        # Sorted flat indices of the ROI in the state arrays, with the start
+        # of each replicate's block; rebuilt when the geometry or shape changes
+        source = getattr(model, COMPARTMENTS[roi]) if isinstance(roi, str) else roi
+        cached = self._index.get(name)
+        if cached is not None and cached[0] is source and cached[1] == shape:
+            return cached[2], cached[3]
+        cells = int(np.prod(shape[-spatial:], dtype=int))
+        n = int(np.prod(shape[:-spatial], dtype=int))
+        if isinstance(roi, str):
+            sites = source
+        else:
+            roi = np.asarray(roi)
+            grid = np.flatnonzero(roi) if roi.dtype == bool else np.unique(roi)
+            sites = (np.arange(n)[:, np.newaxis] * cells + grid).ravel()
+        starts = np.searchsorted(sites, np.arange(n) * cells)
+        self._index[name] = (source, shape, sites, starts)
+        return sites, starts
+
+    def _write(self, t, values):
+        if self._file is None:
+            self._file = open(self.stream, 'w')
+            columns = ['t']
+            for name, value in values.items():
+                columns += [name] if np.ndim(value) == 0 else [f"{name}[{i}]" for i in range(np.size(value))]
+            self._file.write(','.join(columns) + '\n')
+        row = [repr(float(t))]
+        for value in values.values():
+            row += [repr(float(v)) for v in np.ravel(value)]
+        self._file.write(','.join(row) + '\n')
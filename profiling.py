@@ -0,0 +1,112 @@
+"""
+Opt-in instrumentation of CalciumModel.step().
+
+Assigning a StepProfiler to model.profiler makes step() time each of its
+phases and accumulate the timings into counters:
+
+    profiler = StepProfiler(fluxes=True, trace=True)
+    model.profiler = profiler
+    model.advance(1.0)
+    print(profiler.report())
+    profiler.export_trace('step_trace.json')   # open in chrome://tracing or Perfetto
+    model.profiler = None
+
+Phases are 'stimulus', 'gating', 'fluxes', 'ca_diffusion', 'ip3_diffusion',
+'buffer', 'clamp', 'refinement' and 'callbacks', plus 'step' for the whole
+call. With the threaded fused backend the phases inside the tile kernels
+record the time summed over all threads. With fluxes=True the profiler also accumulates the magnitude of
+every flux (sum of |flux| * dt over the grid, in μM summed over pixels).
+"""
+
+import json
+import threading
+import time
+from collections import defaultdict, deque
+
+PHASES = ('stimulus', 'gating', 'fluxes', 'ca_diffusion', 'ip3_diffusion', 'buffer', 'clamp', 'refinement',
+          'callbacks')
+
+
+class StepProfiler:
+    """Accumulate per-phase timings (and optionally flux magnitudes) of step()"""
+
+    def __init__(self, fluxes=False, trace=False, max_events=100000):
+        self.fluxes = fluxes
+        self.trace = trace
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=max_events)
+        self._origin = time.perf_counter()
+        self.reset()
+
+    def reset(self):
+        """Clear all counters and trace events"""
+        with self._lock:
+            self.seconds = defaultdict(float)
+            self.calls = defaultdict(int)
+            self.flux_totals = defaultdict(float)
+            self._events.clear()
+
+    def phase(self, name):
+        """Context manager timing one occurrence of phase `name`"""
+        return _Phase(self, name)
+
+    def add(self, name, start, end):
+        with self._lock:
+            self.seconds[name] += end - start
+            self.calls[name] += 1
+            if self.trace:
+                self._events.append((name, start, end, threading.get_ident()))
+
+    def add_flux(self, name, amount):
+        with self._lock:
+            self.flux_totals[name] += amount
+
+    def summary(self):
+        """{phase: {'seconds', 'calls', 'mean_ms', 'share'}}, share relative to whole steps"""
+        with self._lock:
+            seconds, calls = dict(self.seconds), dict(self.calls)
+        step_seconds = seconds.get('step', 0.0)
+        return {name: {'seconds': seconds[name],
+                       'calls': calls[name],
+                       'mean_ms': 1000 * seconds[name] / calls[name],
+                       'share': seconds[name] / step_seconds if step_seconds else 0.0}
+                for name in seconds}
+
+    def report(self):
+        """Summary formatted as a text table"""
+        summary = self.summary()
+        lines = [f"{'phase':>14} {'calls':>8} {'total s':>10} {'mean ms':>10} {'share':>7}"]
+        for name in ('step',) + PHASES:
+            if name in summary:
+                row = summary[name]
+                lines.append(f"{name:>14} {row['calls']:>8} {row['seconds']:>10.4f} "
+                             f"{row['mean_ms']:>10.4f} {row['share']:>7.1%}")
+        with self._lock:
+            flux_totals = dict(self.flux_totals)
+        for name, amount in flux_totals.items():
+            lines.append(f"{'flux ' + name:>14} {amount:>19.6g}")
+        return '\n'.join(lines)
+
+    def export_trace(self, filename):
+        """Write the recorded phases in the Chrome trace event format"""
+        with self._lock:
+            events = list(self._events)
+        trace = [{'name': name, 'ph': 'X', 'pid': 0, 'tid': thread,
+                  'ts': (start - self._origin) * 1e6, 'dur': (end - start) * 1e6}
+                 for name, start, end, thread in events]
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+
+class _Phase:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.profiler.add(self.name, self.start, time.perf_counter())
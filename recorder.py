@@ -0,0 +1,204 @@
+"""
+Streaming trajectory recording for the calcium model.
+
+A TrajectoryRecorder is attached to a model through model.callbacks and
+captures selected state fields every `stride` steps. Frames are handed to a
+background writer thread, which groups them into chunks along the time axis
+and writes each chunk to its own file, optionally zlib-compressed:
+
+    run.traj/
+        meta.json           field shapes and dtypes, chunking, frame times
+        calcium/000000.npy  frames 0 .. chunk_frames-1 (or .zlib when compressed)
+        calcium/000001.npy  ...
+
+A TrajectoryReader opens such a store for random access playback. Uncompressed
+chunks are memory-mapped and compressed chunks are decompressed one chunk at a
+time, so a run much larger than RAM can be scrubbed frame by frame.
+"""
+
+import json
+import os
+import queue
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_FIELDS = ('calcium', 'er_calcium', 'mito_calcium', 'ip3_conc', 'ip3r_open')
+
+
+class TrajectoryRecorder:
+    """Record model fields to a chunked on-disk store from a writer thread.
+
+    Float fields are stored as `dtype` (float32 by default, or float16 for
+    half the size); integer fields keep their own type. step() only pays for
+    copying the recorded fields. Writing happens on the writer thread, and
+    the model waits only if more than `max_pending` frames are still waiting
+    to be written.
+    """
+
+    def __init__(self, path, fields=DEFAULT_FIELDS, stride=10, dtype=np.float32,
+                 chunk_frames=64, compression='zlib', level=1, max_pending=64):
+        if compression not in (None, 'zlib'):
+            raise ValueError(f"Unknown compression '{compression}', expected None or 'zlib'")
+        self.path = path
+        self.fields = tuple(fields)
+        self.stride = stride
+        self.dtype = np.dtype(dtype)
+        self.chunk_frames = chunk_frames
+        self.compression = compression
+        self.level = level
+
+        self.n_frames = 0
+        self.times = []
+        self._steps = 0
+        self._meta = None
+        self._error = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        os.makedirs(path, exist_ok=True)
+        self._writer.start()
+
+    def __call__(self, model):
+        """Model callback: capture a frame every `stride` steps"""
+        if self._steps % self.stride == 0:
+            self.capture(model)
+        self._steps += 1
+
+    def capture(self, model):
+        """Queue the current state of the recorded fields as one frame"""
+        if self._error is not None:
+            raise RuntimeError(f"Trajectory writer failed: {self._error}")
+        frame = {}
+        for name in self.fields:
+            value = getattr(model, name)
+            stored = self.dtype if np.issubdtype(value.dtype, np.floating) else value.dtype
+            frame[name] = value.astype(stored)
+        if self._meta is None:
+            self._meta = {
+                'fields': {name: {'dtype': array.dtype.str, 'shape': list(array.shape)}
+                           for name, array in frame.items()},
+                'stride': self.stride,
+                'dt': model.dt,
+                'chunk_frames': self.chunk_frames,
+                'compression': self.compression,
+            }
+            for name in self.fields:
+                os.makedirs(os.path.join(self.path, name), exist_ok=True)
+        self.times.append(float(model.t))
+        self.n_frames += 1
+        self._queue.put(frame)
+
+    def close(self):
+        """Flush the remaining frames and write the store metadata"""
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+        if self._error is not None:
+            raise RuntimeError(f"Trajectory writer failed: {self._error}")
+        meta = dict(self._meta or {'fields': {}, 'stride': self.stride,
+                                   'chunk_frames': self.chunk_frames, 'compression': self.compression})
+        meta['n_frames'] = self.n_frames
+        meta['times'] = self.times
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _write_loop(self):
+        pending = []
+        chunk = 0
+        while True:
+            frame = self._queue.get()
+            if frame is not None:
+                pending.append(frame)
+            if pending and (frame is None or len(pending) == self.chunk_frames):
+                try:
+                    self._write_chunk(chunk, pending)
+                except Exception as e:
+                    self._error = e
+                chunk += 1
+                pending = []
+            if frame is None:
+                return
+
+    def _write_chunk(self, chunk, frames):
+        for name in self.fields:
+            block = np.stack([frame[name] for frame in frames])
+            filename = os.path.join(self.path, name, f"{chunk:06d}")
+            if self.compression == 'zlib':
+                with open(filename + '.zlib', 'wb') as f:
+                    f.write(zlib.compress(block.tobytes(), self.level))
+            else:
+                np.save(filename + '.npy', block)
+
+
+class TrajectoryReader:
+    """Random access playback of a store written by TrajectoryRecorder"""
+
+    def __init__(self, path, cache_chunks=4):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self.fields = tuple(self.meta['fields'])
+        self.times = np.asarray(self.meta['times'])
+        self.chunk_frames = self.meta['chunk_frames']
+        self._cache = OrderedDict()
+        self._cache_chunks = cache_chunks
+
+    def __len__(self):
+        return self.meta['n_frames']
+
+    def frame(self, name, index):
+        """Field `name` at frame `index` (negative indices count from the end)"""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Frame {index} out of range for {len(self)} frames")
+        chunk, offset = divmod(index, self.chunk_frames)
+        return self._chunk(name, chunk)[offset]
+
+    def __getitem__(self, key):
+        """reader[name, index] -> one frame, reader[name] -> list-like view of all frames"""
+        if isinstance(key, tuple):
+            return self.frame(*key)
+        return _FieldView(self, key)
+
+    def _chunk(self, name, chunk):
+        key = (name, chunk)
+        block = self._cache.get(key)
+        if block is not None:
+            self._cache.move_to_end(key)
+            return block
+
+        filename = os.path.join(self.path, name, f"{chunk:06d}")
+        if self.meta['compression'] == 'zlib':
+            info = self.meta['fields'][name]
+            with open(filename + '.zlib', 'rb') as f:
+                data = zlib.decompress(f.read())
+            block = np.frombuffer(data, dtype=np.dtype(info['dtype'])).reshape(-1, *info['shape'])
+        else:
+            block = np.load(filename + '.npy', mmap_mode='r')
+        self._cache[key] = block
+        if len(self._cache) > self._cache_chunks:
+            self._cache.popitem(last=False)
+        return block
+
+
+class _FieldView:
+    def __init__(self, reader, name):
+        self.reader = reader
+        self.name = name
+
+    def __len__(self):
+        return len(self.reader)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return np.stack([self.reader.frame(self.name, i) for i in range(*index.indices(len(self)))])
+        return self.reader.frame(self.name, index)
@@ -0,0 +1,214 @@
+"""
+Content-addressed cache of simulation results.
+
+A run is identified by a SHA-256 digest of everything that determines its
+outcome: the parameters written by save_parameters, the seed and random
+generator state, the starting state and cell geometry, the scheduled
+stimulus protocol, the run length and the observables recorded along the way.
+Finished runs are stored on disk under that digest, so repeating an identical
+run loads its final checkpoint and recorded traces instead of simulating:
+
+    cache = ResultCache('result_cache', max_bytes=10 * 2**30)
+    model.schedule_stimulus(stimulus.pulse(1.0, start=0.5, duration=0.2))
+    result = model.advance_cached(5.0, cache, observables=obs)
+
+Every entry is a directory holding the checkpoint, the traces and a manifest
+with the size and SHA-256 of each file. Entries are checked against their
+manifest when loaded; a damaged entry is removed and counts as a miss. When
+the cache grows past max_bytes the least recently used entries are evicted.
+Entries are written under a temporary name and renamed into place, so
+processes can share one cache directory.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+MANIFEST = 'manifest.json'
+CHECKPOINT = 'state.ckpt'
+TRACES = 'traces.npz'
+
+
+class ResultCache:
+    """Finished runs on local disk, keyed by the digest of their inputs"""
+
+    def __init__(self, directory, max_bytes=2**30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, model, observables=None, **run):
+        """Digest of the run of `model` described by the keyword arguments (duration, steps, ...)"""
+        digest = hashlib.sha256()
+        # Everything a checkpoint of the model holds, plus the run itself
+        header, arrays = model.checkpoint_contents()
+        description = dict(header, seed=model.seed, observables=_observable_specs(observables), run=run)
+        digest.update(json.dumps(description, sort_keys=True, default=_json_default).encode('utf-8'))
+        for name, array in arrays.items():
+            digest.update(name.encode('ascii'))
+            digest.update(_array_digest(array).encode('ascii'))
+        return digest.hexdigest()
+
+    def load(self, key, model, observables=None):
+        """Restore the stored result of run `key` into `model`; returns its record, or None on a miss"""
+        path = os.path.join(self.directory, key)
+        manifest = self._verified_manifest(path)
+        if manifest is None:
+            self.misses += 1
+            return None
+        # The traces are read and the entry touched before the model is
+        # changed, and load_checkpoint validates the file before applying
+        # it, so a miss leaves the model in its starting state
+        try:
+            traces = None
+            if observables is not None and TRACES in manifest['files']:
+                with np.load(os.path.join(path, TRACES)) as data:
+                    traces = data['t'], {name: data[name] for name in observables.names}
+            # Touch the manifest: its modification time orders the LRU eviction
+            os.utime(os.path.join(path, MANIFEST))
+            model.load_checkpoint(os.path.join(path, CHECKPOINT))
+        except (OSError, ValueError, KeyError):
+            # Evicted or damaged since it was verified
+            self.misses += 1
+            return None
+        if traces is not None:
+            observables.extend(*traces, manifest['observed_steps'])
+        self.hits += 1
+        return manifest['record']
+
+    @staticmethod
+    def mark(observables):
+        """Position of `observables` before a run, to be passed to store()"""
+        return (observables.n_samples, observables._steps) if observables is not None else (0, 0)
+
+    def store(self, key, model, observables=None, start=(0, 0), record=None):
+        """Store the current state of `model` as the result of run `key`.
+
+        `start` is mark(observables) taken before the run, so only the run's
+        own samples are kept. `record` is any JSON-serializable summary of
+        the run, returned by load() on a hit.
+        """
+        path = os.path.join(self.directory, key)
+        if os.path.isdir(path):
+            return
+        temp = os.path.join(self.directory, f".{key}.{os.getpid()}.tmp")
+        os.makedirs(temp, exist_ok=True)
+        try:
+            model.save_checkpoint(os.path.join(temp, CHECKPOINT))
+            if observables is not None:
+                times, values = observables.export(start[0])
+                np.savez(os.path.join(temp, TRACES), t=times, **values)
+            files = {}
+            for name in os.listdir(temp):
+                files[name] = {'size': os.path.getsize(os.path.join(temp, name)),
+                               'sha256': _file_digest(os.path.join(temp, name))}
+            manifest = {'key': key, 'created': time.time(), 'files': files,
+                        'observed_steps': observables._steps - start[1] if observables is not None else 0,
+                        'record': {} if record is None else record}
+            with open(os.path.join(temp, MANIFEST), 'w') as f:
+                json.dump(manifest, f, default=_json_default)
+            try:
+                os.rename(temp, path)
+            except OSError:
+                # Another process stored the same run first
+                pass
+        finally:
+            shutil.rmtree(temp, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        for key in os.listdir(self.directory):
+            manifest = os.path.join(self.directory, key, MANIFEST)
+            if key.startswith('.') or not os.path.exists(manifest):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(self.directory, key, name))
+                           for name in os.listdir(os.path.join(self.directory, key)))
+                entries.append((os.path.getmtime(manifest), size, key))
+            except OSError:
+                # Removed by another process while being listed
+                continue
+            total += size
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+            total -= size
+
+    def size(self):
+        """Bytes held by the stored entries"""
+        total = 0
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+
+    def clear(self):
+        """Remove every stored entry"""
+        for key in os.listdir(self.directory):
+            shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+
+    def _verified_manifest(self, path):
+        if not os.path.exists(os.path.join(path, MANIFEST)):
+            return None
+        try:
+            with open(os.path.join(path, MANIFEST), 'r') as f:
+                manifest = json.load(f)
+            for name, info in manifest['files'].items():
+                filename = os.path.join(path, name)
+                if os.path.getsize(filename) != info['size'] or _file_digest(filename) != info['sha256']:
+                    raise ValueError(f"{name} does not match its checksum")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Warning: discarding damaged cache entry {os.path.basename(path)}: {e}")
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+        return manifest
+
+
+def _observable_specs(observables):
+    if observables is None:
+        return None
+    specs = []
+    for name in observables.names:
+        field, reduction, roi = observables._specs[name]
+        if roi is not None and not isinstance(roi, str):
+            roi = _array_digest(np.asarray(roi))
+        specs.append([name, field, reduction, roi])
+    return {'specs': specs, 'stride': observables.stride, 'phase': observables._steps % observables.stride}
+
+
+def _array_digest(array):
+    if array is None:
+        return None
+    array = np.ascontiguousarray(array)
+    digest = hashlib.sha256(f"{array.dtype.str}{array.shape}".encode('ascii'))
+    digest.update(array.data)
+    return digest.hexdigest()
+
+
+def _file_digest(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _json_default(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
@@ -0,0 +1,145 @@
+"""
+Background execution of the calcium model.
+
+A SimulationRunner advances a model on a worker thread in batches of
+`steps_per_frame` steps, optionally paced to a target realtime factor
+(simulated seconds per wall-clock second). A viewer pulls the latest frame
+with frame() at its own display rate; the worker copies the displayed fields
+only when a frame has been asked for, so a slow display drops frames instead
+of slowing the physics.
+
+Anything that changes the model from another thread while the runner is
+active should hold runner.lock:
+
+    runner = SimulationRunner(model, steps_per_frame=10, realtime_factor=0.5)
+    runner.start()
+    ...
+    with runner.lock:
+        model.add_ip3_global(1.0, 0.1)
+    frame = runner.frame()      # None when no new frame is ready yet
+    runner.stop()
+
+Longer operations on the model (a steady-state solve, say) can be handed to
+the worker with submit(), which runs them under the lock between batches of
+steps, or on a thread of their own while the runner is stopped, and returns
+a concurrent.futures.Future for the result.
+"""
+
+import threading
+import time
+from concurrent.futures import Future
+
+FRAME_FIELDS = ('calcium', 'er_calcium', 'mito_calcium', 'ip3_conc', 'ip3r_open')
+
+
+class SimulationRunner:
+    """Advance a model on a worker thread and hand out frames on request"""
+
+    def __init__(self, model, steps_per_frame=1, realtime_factor=None, fields=FRAME_FIELDS):
+        self.model = model
+        self.steps_per_frame = steps_per_frame
+        # Target simulated seconds per wall-clock second (None runs flat out)
+        self.realtime_factor = realtime_factor
+        self.fields = tuple(fields)
+        self.lock = threading.RLock()
+        self.error = None
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._frame = None
+        self._frame_lock = threading.Lock()
+        self._frame_requested = True
+        self._tasks = []
+        self._tasks_lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start advancing the model (does nothing if already running)"""
+        if self.running:
+            return
+        self.error = None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop after the current batch of steps and wait for the worker"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if self._tasks:
+            # Submitted as the worker was finishing
+            threading.Thread(target=self._run_tasks, daemon=True).start()
+
+    def submit(self, task, *args):
+        """Run task(*args) on the worker thread; returns a Future for its result"""
+        future = Future()
+        with self._tasks_lock:
+            self._tasks.append((future, task, args))
+        if not self.running:
+            threading.Thread(target=self._run_tasks, daemon=True).start()
+        return future
+
+    def capture(self):
+        """Copy of the frame fields (plus the simulated time) taken under the lock"""
+        with self.lock:
+            frame = {name: getattr(self.model, name).copy() for name in self.fields}
+            frame['t'] = self.model.t
+        return frame
+
+    def frame(self):
+        """The newest frame since the last call, or None if none is ready yet"""
+        with self._frame_lock:
+            frame, self._frame = self._frame, None
+            self._frame_requested = True
+        return frame
+
+    def _run(self):
+        wall_start = time.perf_counter()
+        sim_start = self.model.t
+        factor = self.realtime_factor
+        while not self._stop.is_set():
+            self._run_tasks()
+            try:
+                with self.lock:
+                    for _ in range(self.steps_per_frame):
+                        self.model.step()
+                    if self._frame_requested:
+                        frame = self.capture()
+                        with self._frame_lock:
+                            self._frame = frame
+                            self._frame_requested = False
+            except Exception as e:
+                self.error = e
+                break
+
+            # Pace to the target realtime factor, restarting the clock when
+            # the target changes or the model is reset
+            if self.realtime_factor != factor or self.model.t < sim_start:
+                wall_start, sim_start, factor = time.perf_counter(), self.model.t, self.realtime_factor
+            if factor:
+                ahead = (self.model.t - sim_start) / factor - (time.perf_counter() - wall_start)
+                if ahead > 0:
+                    self._stop.wait(ahead)
+        # Tasks submitted while stopping would otherwise never run
+        self._run_tasks()
+
+    def _run_tasks(self):
+        while True:
+            with self._tasks_lock:
+                if not self._tasks:
+                    return
+                future, task, args = self._tasks.pop(0)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with self.lock:
+                    result = task(*args)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
@@ -0,0 +1,97 @@
+"""
+IP3 uncaging protocols for the calcium model.
+
+A Stimulus releases IP3 over a spatial footprint at a constant or linearly
+ramped rate during [start, start + duration) of simulated time. Footprints
+are precomputed once as flat indices into the grid (None means the whole
+cell; disk() gives a spot on a 2D grid and ball() one in a 3D volume).
+Stimuli are scheduled on a model and applied inside step(), each step
+receiving exactly the amount released during its own time interval:
+
+    import stimulus
+    model.schedule_stimulus(stimulus.pulse(1.0, start=0.5, duration=0.2))
+    spot = stimulus.disk(model.grid_size, 100, 100, 5)
+    model.schedule_stimulus(stimulus.train(0.5, start=1.0, duration=0.05,
+                                           interval=0.5, count=10, footprint=spot))
+    model.advance(6.0)
+"""
+
+import numpy as np
+
+
+class Stimulus:
+    """IP3 release over `footprint` from `start` for `duration` seconds.
+
+    The rate (μM/s) goes linearly from `rate` at the start to `end_rate` at
+    the end; without `end_rate` it is constant.
+    """
+
+    def __init__(self, footprint, start, duration, rate, end_rate=None):
+        if duration <= 0:
+            raise ValueError(f"Stimulus duration must be positive, got {duration}")
+        self.footprint = footprint
+        self.start = start
+        self.duration = duration
+        self.rate = rate
+        self.end_rate = end_rate
+
+    @property
+    def end(self):
+        return self.start + self.duration
+
+    def amount(self, t0, t1):
+        """IP3 (μM) released per footprint pixel during [t0, t1)"""
+        lo, hi = max(t0, self.start), min(t1, self.end)
+        if hi <= lo:
+            return 0.0
+        if self.end_rate is None:
+            return self.rate * (hi - lo)
+        # Exact integral of the linear ramp: mean of the rates at both ends
+        slope = (self.end_rate - self.rate) / self.duration
+        return (hi - lo) * (self.rate + slope * ((lo + hi) / 2 - self.start))
+
+    def to_dict(self):
+        return {'start': float(self.start), 'duration': float(self.duration), 'rate': float(self.rate),
+                'end_rate': None if self.end_rate is None else float(self.end_rate)}
+
+
+def pulse(amount, start, duration, footprint=None):
+    """Release `amount` μM evenly over `duration` seconds"""
+    return Stimulus(footprint, start, duration, amount / duration)
+
+
+def train(amount, start, duration, interval, count, footprint=None):
+    """`count` pulses of `amount` μM each, starting every `interval` seconds"""
+    return [pulse(amount, start + i * interval, duration, footprint) for i in range(count)]
+
+
+def ramp(amount, start, duration, footprint=None, rising=True):
+    """Release `amount` μM at a rate rising linearly from zero (or falling to zero)"""
+    peak = 2 * amount / duration
+    return Stimulus(footprint, start, duration, 0.0 if rising else peak, peak if rising else 0.0)
+
+
+def disk(grid_size, x, y, radius):
+    """Flat indices of the pixels within `radius` of column x, row y"""
+    rows = np.arange(max(0, int(np.floor(y - radius))), min(grid_size, int(np.ceil(y + radius)) + 1))
+    cols = np.arange(max(0, int(np.floor(x - radius))), min(grid_size, int(np.ceil(x + radius)) + 1))
+    inside = (cols[np.newaxis, :] - x)**2 + (rows[:, np.newaxis] - y)**2 <= radius**2
+    rr, cc = np.nonzero(inside)
+    return rows[rr] * grid_size + cols[cc]
+
+
+def ball(grid_size, x, y, z, radius):
+    """Flat indices of the voxels of a 3D grid within `radius` of column x, row y, plane z"""
+    planes = np.arange(max(0, int(np.floor(z - radius))), min(grid_size, int(np.ceil(z + radius)) + 1))
+    indices = []
+    for plane in planes:
+        # Each plane holds a disk of the radius left at its distance from z
+        reach = radius**2 - (plane - z)**2
+        if reach >= 0:
+            indices.append(plane * grid_size**2 + disk(grid_size, x, y, np.sqrt(reach)))
+    return np.concatenate(indices) if indices else np.array([], dtype=np.int64)
+
+
+def from_mask(mask):
+    """Flat indices of the True pixels of a boolean grid"""
+    return np.flatnonzero(mask)
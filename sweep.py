@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Headless parameter sweeps for the calcium model.
+
+Runs the model without the GUI over the grid of values spanned by one or more
+sweep axes, fanning the runs out over a process pool. Each finished run is
+appended to a JSON-lines results file as soon as it completes.
+
+Example:
+    python sweep.py default_state.json --sweep serca_rate=0.2,0.4,0.6 \\
+        --sweep buffer_total=50:150:11 --steps 5000 --workers 16 -o results.jsonl
+
+With --result-cache DIR, runs already stored in DIR by an earlier sweep (same
+parameters, seed, IP3 protocol and step count) are loaded instead of rerun.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import geometry
+from calcium_model import CalciumModel
+from result_cache import ResultCache
+
+
+def parse_axis(spec):
+    """Parse 'name=v1,v2,...' or 'name=start:stop:num' into (name, values)"""
+    name, sep, values = spec.partition('=')
+    if not sep or not name or not values:
+        raise argparse.ArgumentTypeError(f"Invalid sweep axis '{spec}', expected name=v1,v2,... or name=start:stop:num")
+    if ':' in values:
+        start, stop, num = values.split(':')
+        return name, np.linspace(float(start), float(stop), int(num)).tolist()
+    return name, [json.loads(v) for v in values.split(',')]
+
+
+def build_runs(base_params, axes, seed):
+    """Expand the sweep axes into a list of (index, params, seed) runs"""
+    names = [name for name, _ in axes]
+    grid = list(itertools.product(*(values for _, values in axes)))
+    seeds = np.random.SeedSequence(seed).generate_state(len(grid))
+    runs = []
+    for index, (values, run_seed) in enumerate(zip(grid, seeds)):
+        params = dict(base_params)
+        params.update(zip(names, values))
+        runs.append((index, params, int(run_seed)))
+    return runs
+
+
+def summarize(model):
+    """Whole-cell summary of the model state"""
+    return {
+        'mean_calcium': float(model.calcium.mean()),
+        'max_calcium': float(model.calcium.max()),
+        'mean_er_calcium': float(model.er_calcium[model.er == 1].mean()),
+        'mean_mito_calcium': float(model.mito_calcium[model.mitochondria == 1].mean()),
+        'mean_ip3': float(model.ip3_conc.mean()),
+        'open_ip3r': int(model.ip3r_open.sum()),
+    }
+
+
+def run_simulation(index, params, seed, steps, ip3_amount=0.0, backend="numpy", state_dir=None,
+                   geometry_cache=None, result_cache=None, cache_size=2**30):
+    """Run one simulation and return its result record.
+
+    With result_cache (a directory) a run identical to one already stored
+    there is loaded instead of simulated.
+    """
+    start = time.perf_counter()
+    if geometry_cache is not None:
+        geometry.configure_cache(directory=geometry_cache)
+    model = CalciumModel(**dict(params, backend=backend, seed=seed))
+    if ip3_amount:
+        model.add_ip3_global(ip3_amount, model.dt)
+    cache = None
+    cached = False
+    if result_cache is not None:
+        cache = ResultCache(result_cache, cache_size)
+        key = cache.key(model, steps=steps)
+        cached = cache.load(key, model) is not None
+    if not cached:
+        for _ in range(steps):
+            model.step()
+        if cache is not None:
+            cache.store(key, model)
+
+    result = {'run': index, 'seed': seed, 'geometry_seed': model.geometry_seed, 'steps': steps,
+              'params': params, 'cached': cached}
+    result.update(summarize(model))
+    if state_dir is not None:
+        state_file = os.path.join(state_dir, f"run_{index:05d}.npz")
+        np.savez_compressed(state_file, calcium=model.calcium, er_calcium=model.er_calcium,
+                            mito_calcium=model.mito_calcium, ip3_conc=model.ip3_conc,
+                            ip3r_open=model.ip3r_open)
+        result['state_file'] = state_file
+    result['wall_time'] = time.perf_counter() - start
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run headless calcium model parameter sweeps.")
+    parser.add_argument('parameters', help="parameter file written by CalciumModel.save_parameters")
+    parser.add_argument('--sweep', action='append', type=parse_axis, default=[], metavar='NAME=VALUES',
+                        help="sweep axis as name=v1,v2,... or name=start:stop:num (repeatable)")
+    parser.add_argument('--steps', type=int, default=1000, help="time steps per run")
+    parser.add_argument('--ip3', type=float, default=0.0, help="global IP3 uncaged at the start of each run (μM)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument('--seed', type=int, default=0, help="base seed from which per-run seeds are derived")
+    parser.add_argument('--geometry-seed', type=int,
+                        help="use the same cell geometry for every run (default: one per run seed)")
+    parser.add_argument('--geometry-cache', help="directory in which workers share generated cell geometries")
+    parser.add_argument('--result-cache', help="directory of stored runs; identical runs are loaded, not simulated")
+    parser.add_argument('--cache-size', type=float, default=1.0, help="result cache size limit (GiB)")
+    parser.add_argument('--backend', choices=('numpy', 'fused'), default='fused')
+    parser.add_argument('-o', '--output', default='sweep_results.jsonl', help="JSON-lines results file")
+    parser.add_argument('--state-dir', help="also save the final state of every run to this directory")
+    args = parser.parse_args(argv)
+
+    with open(args.parameters, 'r') as f:
+        base_params = json.load(f)
+    for name, _ in args.sweep:
+        if name not in base_params:
+            parser.error(f"Unknown sweep parameter '{name}'")
+    if args.state_dir:
+        os.makedirs(args.state_dir, exist_ok=True)
+
+    # Parameter files record the geometry seed of the model that wrote them;
+    # unless it is fixed or swept, every run draws its cell from its own seed
+    if args.geometry_seed is not None:
+        base_params['geometry_seed'] = args.geometry_seed
+    elif 'geometry_seed' not in (name for name, _ in args.sweep):
+        base_params.pop('geometry_seed', None)
+    runs = build_runs(base_params, args.sweep, args.seed)
+    print(f"Running {len(runs)} simulations on {args.workers} workers")
+    with open(args.output, 'w') as out, ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(run_simulation, index, params, seed, args.steps,
+                               args.ip3, args.backend, args.state_dir, args.geometry_cache,
+                               args.result_cache, int(args.cache_size * 2**30))
+                   for index, params, seed in runs]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+            source = " (cached)" if result['cached'] else ""
+            print(f"[{done}/{len(runs)}] run {result['run']} finished in {result['wall_time']:.1f} s{source}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
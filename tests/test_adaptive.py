@@ -0,0 +1,32 @@
+import warnings
+
+import numpy as np
+
+import stimulus
+from calcium_model import CalciumModel
+from observables import Observables
+
+
+def test_callbacks_only_see_accepted_steps():
+    model = CalciumModel(grid_size=32, seed=1, diffusion='implicit', buffer_substeps=20,
+                         adaptive=True, rtol=1e-3, atol=1e-5, gating='binomial')
+    model.schedule_stimulus(stimulus.pulse(1.0, start=0.01, duration=0.01))
+    obs = Observables().add_standard()
+    model.callbacks.append(obs)
+    result = model.advance(0.1)
+
+    assert result['rejected'] > 0
+    times, _ = obs.trace('calcium_mean')
+    assert len(times) == result['accepted']
+    assert np.all(np.diff(times) > 0)
+
+
+def test_overflowing_trial_step_is_rejected_quietly():
+    # Diffusion this fast overflows any trial step much above dt_min
+    model = CalciumModel(grid_size=16, seed=0, adaptive=True, D_ca=1e307)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        result = model.advance(0.01)
+
+    assert result['rejected'] > 0
+    assert np.isfinite(model.calcium).all()
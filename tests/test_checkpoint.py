@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+import pytest
+
+from calcium_ensemble import CalciumEnsemble
+from calcium_model import CalciumModel
+
+
+def test_mismatched_checkpoint_leaves_model_unchanged(tmp_path):
+    filename = str(tmp_path / 'ensemble.ckpt')
+    ensemble = CalciumEnsemble(2, grid_size=16, seed=0, pmca_rate=0.2)
+    ensemble.save_checkpoint(filename)
+
+    model = CalciumModel(grid_size=32, seed=1)
+    model.step()
+    before = model.get_parameters(), model.t, model.calcium.copy()
+    with pytest.raises(ValueError, match='shape'):
+        model.load_checkpoint(filename)
+    assert model.get_parameters() == before[0]
+    assert model.t == before[1]
+    assert model.kernel.shape == (3, 3)
+    assert np.array_equal(model.calcium, before[2])
+
+
+@pytest.mark.parametrize('backend', ['numpy', 'fused'])
+def test_resave_to_loaded_path(tmp_path, backend):
+    filename = str(tmp_path / 'state.ckpt')
+    model = CalciumModel(grid_size=32, seed=2, backend=backend)
+    model.step()
+    model.save_checkpoint(filename)
+
+    loaded = CalciumModel(grid_size=8, backend=backend)
+    loaded.load_checkpoint(filename)
+    loaded.save_checkpoint(filename)
+    for m in (model, loaded):
+        m.step()
+    assert np.array_equal(loaded.calcium, model.calcium)
+
+    again = CalciumModel(grid_size=8, backend=backend)
+    again.load_checkpoint(filename)
+    again.step()
+    assert np.array_equal(again.calcium, model.calcium)
+    assert os.listdir(tmp_path) == ['state.ckpt']
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+import stimulus
+from calcium_ensemble import CalciumEnsemble
+
+
+@pytest.mark.parametrize('name, values', [
+    ('dt', [0.001, 0.002]),
+    ('dt_min', [0.001, 0.002]),
+    ('dt_max', [0.001, 0.002]),
+    ('buffer_substeps', [1, 4]),
+    ('ip3_substeps', [1, 4]),
+    ('slow_interval', [1, 4]),
+])
+def test_stepping_parameters_must_be_shared(name, values):
+    with pytest.raises(ValueError, match=name):
+        CalciumEnsemble(2, grid_size=16, **{name: values})
+
+
+def test_rates_may_vary_per_replicate():
+    ensemble = CalciumEnsemble(2, grid_size=16, seed=0, pmca_rate=[0.1, 0.2],
+                               buffer_substeps=2, slow_interval=2)
+    for _ in range(4):
+        ensemble.step()
+    assert ensemble.calcium.shape == (2, 16, 16)
+    assert np.isfinite(ensemble.calcium).all()
+
+
+def test_replicate_continues_the_protocol():
+    ensemble = CalciumEnsemble(2, grid_size=16, seed=0, slow_interval=3)
+    ensemble.schedule_stimulus(stimulus.pulse(1.0, start=0.0, duration=1.0))
+    for _ in range(4):
+        ensemble.step()
+    model = ensemble.replicate(1)
+    assert model.t == ensemble.t
+    assert len(model.stimuli) == 1
+    assert (model._slow_steps, model._slow_elapsed) == (ensemble._slow_steps, ensemble._slow_elapsed)
+    ip3 = model.ip3_conc.copy()
+    model.step()
+    assert (model.ip3_conc > ip3).any()
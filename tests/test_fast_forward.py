@@ -0,0 +1,24 @@
+import numpy as np
+
+from calcium_model import CalciumModel
+
+
+def resting_model(**params):
+    model = CalciumModel(grid_size=32, seed=3, ip3r_open_rate=1e-6, rtol=1e-2, atol=1e-2,
+                         fast_forward=True, **params)
+    model.steady_state()
+    return model
+
+
+def test_drift_probe_covers_a_slow_interval():
+    model = resting_model(slow_interval=4)
+    er_calcium = model.er_calcium.copy()
+    steps, jumped = model._fast_forward(0.1)
+    assert (steps, jumped) == (4, 1)
+    # The ER exchange is only updated every slow_interval steps, but still drifts
+    assert not np.array_equal(model.er_calcium, er_calcium)
+
+
+def test_no_jumps_with_refinement():
+    model = resting_model(refine=2)
+    assert model.advance(0.02)['jumps'] == 0
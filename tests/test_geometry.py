@@ -0,0 +1,45 @@
+import os
+
+import numpy as np
+import pytest
+
+import geometry
+from calcium_model import CalciumModel
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    geometry.clear_cache()
+    yield
+    geometry.configure_cache()
+    geometry.clear_cache()
+
+
+def test_reset_reuses_the_cached_layout():
+    model = CalciumModel(grid_size=32, seed=0)
+    er = model.er
+    model.reset()
+    assert model.er is er
+    assert not model.er.flags.writeable
+
+
+def test_least_recently_used_layout_is_evicted():
+    geometry.configure_cache(max_entries=2)
+    first = geometry.cell_structure(32, 0.01, 5, 1)
+    second = geometry.cell_structure(32, 0.01, 5, 2)
+    assert geometry.cell_structure(32, 0.01, 5, 1) is first
+    geometry.cell_structure(32, 0.01, 5, 3)
+    assert geometry.cell_structure(32, 0.01, 5, 1) is first
+    assert geometry.cell_structure(32, 0.01, 5, 2) is not second
+
+
+def test_directory_cache_is_shared(tmp_path, monkeypatch):
+    geometry.configure_cache(directory=str(tmp_path))
+    layout = geometry.cell_structure(32, 0.01, 5, 7)
+    assert len(os.listdir(tmp_path)) == 1
+
+    # Another process starts with an empty memory cache and must not regenerate
+    geometry.clear_cache()
+    monkeypatch.setattr(geometry, 'generate_cell_structure', None)
+    for cached, array in zip(geometry.cell_structure(32, 0.01, 5, 7), layout):
+        assert np.array_equal(cached, array)
@@ -0,0 +1,40 @@
+import numpy as np
+
+from calcium_ensemble import CalciumEnsemble
+from calcium_model import CalciumModel
+from observables import Observables
+
+
+def test_ring_buffer_keeps_the_newest_samples():
+    model = CalciumModel(grid_size=16, seed=0)
+    obs = Observables(capacity=4).add('calcium_max', 'calcium', 'max')
+    model.callbacks.append(obs)
+    expected = []
+    for _ in range(7):
+        model.step()
+        expected.append((model.t, model.calcium.max()))
+
+    times, values = obs.trace('calcium_max')
+    assert obs.n_samples == 7
+    assert np.array_equal(times, [t for t, _ in expected[-4:]])
+    assert np.array_equal(values, [v for _, v in expected[-4:]])
+    assert obs.latest()['calcium_max'] == expected[-1][1]
+
+    # Samples already overwritten are skipped by export()
+    times, values = obs.export(since=1)
+    assert len(times) == 4
+    times, values = obs.export(since=5)
+    assert np.array_equal(values['calcium_max'], [v for _, v in expected[5:]])
+
+
+def test_roi_reductions_per_replicate():
+    ensemble = CalciumEnsemble(3, grid_size=16, seed=0, shared_geometry=False)
+    roi = np.zeros((16, 16), dtype=bool)
+    roi[4:8, 2:6] = True
+    obs = Observables(capacity=2).add('spot', 'calcium', 'mean', roi=roi).add('er', 'er_calcium', 'sum', roi='er')
+    ensemble.step()
+    obs.sample(ensemble)
+
+    latest = obs.latest()
+    assert np.allclose(latest['spot'], ensemble.calcium[:, roi].mean(axis=1))
+    assert np.allclose(latest['er'], [(e * (mask == 1)).sum() for e, mask in zip(ensemble.er_calcium, ensemble.er)])
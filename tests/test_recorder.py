@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from calcium_model import CalciumModel
+from recorder import TrajectoryReader, TrajectoryRecorder
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_frames_round_trip(tmp_path, compression):
+    path = str(tmp_path / 'run.traj')
+    model = CalciumModel(grid_size=16, seed=0)
+    expected = []
+    with TrajectoryRecorder(path, stride=2, chunk_frames=3, compression=compression) as recorder:
+        model.callbacks.append(recorder)
+        for step in range(10):
+            # Callbacks run at the end of step(), so frames hold post-step states
+            model.step()
+            if step % 2 == 0:
+                expected.append((model.t, model.calcium.astype(np.float32), model.ip3r_open.copy()))
+
+    reader = TrajectoryReader(path)
+    assert len(reader) == 5
+    for index, (t, calcium, ip3r_open) in enumerate(expected):
+        assert reader.times[index] == t
+        assert np.array_equal(reader['calcium', index], calcium)
+        assert np.array_equal(reader['ip3r_open', index], ip3r_open)
+        assert reader['ip3r_open', index].dtype == ip3r_open.dtype
+    assert np.array_equal(reader['calcium', -1], expected[-1][1])
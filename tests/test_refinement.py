@@ -0,0 +1,37 @@
+import numpy as np
+
+from calcium_model import CalciumModel
+
+
+def test_refined_binomial_run_stays_non_negative():
+    model = CalciumModel(grid_size=64, seed=0, ip3r_open_rate=3e4, diffusion='implicit',
+                         buffer_substeps=20, refine=4, gating='binomial')
+    model.add_ip3_global(1.0, 0.05)
+    refined = 0
+    for _ in range(60):
+        model.step()
+        for patch in model.patches.patches:
+            refined += 1
+            r0, r1, c0, c1 = patch['rect']
+            fine = patch['fine']
+            assert fine.min() >= 0
+            means = fine.reshape(r1 - r0, 4, c1 - c0, 4).mean(axis=(1, 3))
+            np.testing.assert_allclose(means, model.calcium[r0:r1, c0:c1], rtol=1e-12, atol=1e-15)
+    assert refined
+
+
+def test_refinement_does_not_change_the_trajectory():
+    models = [CalciumModel(grid_size=48, seed=2, ip3r_open_rate=3e4, diffusion='implicit',
+                           gating='binomial', refine=refine) for refine in (1, 4)]
+    for model in models:
+        model.add_ip3_global(1.0, 0.05)
+        for _ in range(40):
+            model.step()
+    coarse, refined = models
+    assert refined.patches.patches
+    for name in coarse.state_fields + ('ip3r_open',):
+        assert np.array_equal(getattr(coarse, name), getattr(refined, name)), name
+    # The reconstruction peaks above the pixel average at open clusters
+    open_sites = refined.ip3r_site_open > 0
+    pixels = refined.calcium.flat[refined.ip3r_sites]
+    assert np.any(refined.nanodomain_calcium()[open_sites] > pixels[open_sites])
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from calcium_model import CalciumModel
+
+STEPS = 5
+
+
+def run(steps=STEPS, ip3r_open_rate=50, **params):
+    model = CalciumModel(seed=4, ip3r_open_rate=ip3r_open_rate, **params)
+    model.add_ip3_global(1.0, 0.01)
+    for _ in range(steps):
+        model.step()
+    return model
+
+
+def assert_same_state(a, b):
+    for name in a.state_fields + ('ip3r_open',):
+        assert np.array_equal(getattr(a, name), getattr(b, name)), name
+    assert a.t == b.t
+
+
+@pytest.mark.parametrize('params', [
+    {},
+    {'diffusion': 'implicit'},
+    {'gating': 'binomial', 'buffer_substeps': 4, 'ip3_substeps': 2, 'slow_interval': 3},
+    {'dtype': 'float32'},
+])
+def test_fused_matches_numpy(params):
+    assert_same_state(run(grid_size=40, backend='numpy', **params),
+                      run(grid_size=40, backend='fused', **params))
+
+
+@pytest.mark.parametrize('tiles', [2, 3, 7])
+def test_tile_count_does_not_change_result(tiles):
+    assert_same_state(run(grid_size=40, backend='fused', tiles=1),
+                      run(grid_size=40, backend='fused', tiles=tiles, threads=2))
+
+
+@pytest.mark.parametrize('tiles', [1, 2, 5])
+def test_3d_slabs_match_numpy(tiles):
+    assert_same_state(run(grid_size=12, ndim=3, backend='numpy'),
+                      run(grid_size=12, ndim=3, backend='fused', tiles=tiles, threads=2))
+
+
+@pytest.mark.parametrize('params', [
+    {'backend': 'fused', 'gating': 'binomial'},
+    {'adaptive': True, 'slow_interval': 3},
+    {'refine': 2, 'diffusion': 'implicit'},
+])
+def test_checkpoint_resumes_exactly(tmp_path, params):
+    filename = str(tmp_path / 'state.ckpt')
+    model = run(grid_size=32, steps=0, ip3r_open_rate=500, **params)
+    model.advance(3 * model.dt)
+    model.save_checkpoint(filename)
+
+    resumed = CalciumModel(grid_size=8)
+    resumed.load_checkpoint(filename)
+    model.advance(20 * model.dt)
+    resumed.advance(20 * resumed.dt)
+    assert_same_state(resumed, model)
@@ -0,0 +1,77 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from calcium_model import CalciumModel
+from result_cache import ResultCache
+
+
+def test_key_covers_step_scheduling_state(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    model = CalciumModel(grid_size=16, seed=0, slow_interval=4)
+    before = cache.key(model, duration=0.01)
+    model._slow_steps, model._slow_elapsed = 1, model.dt
+    assert cache.key(model, duration=0.01) != before
+
+
+def test_vanished_entry_is_a_miss(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path))
+    model = CalciumModel(grid_size=16, seed=0)
+    key = cache.key(model, duration=0.005)
+    model.advance(0.005)
+    cache.store(key, model)
+
+    # Another process evicts the entry between verification and loading
+    verified = cache._verified_manifest
+
+    def evicted(path):
+        manifest = verified(path)
+        shutil.rmtree(path)
+        return manifest
+    monkeypatch.setattr(cache, '_verified_manifest', evicted)
+    assert cache.load(key, CalciumModel(grid_size=16, seed=0)) is None
+    assert cache.misses == 1
+
+
+def test_evict_skips_vanished_entries(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path), max_bytes=0)
+    os.makedirs(tmp_path / 'gone')
+    (tmp_path / 'gone' / 'manifest.json').write_text('{}')
+
+    # The entry disappears after its manifest was found
+    exists = os.path.exists
+
+    def racing(path):
+        found = exists(path)
+        shutil.rmtree(tmp_path / 'gone', ignore_errors=True)
+        return found
+    monkeypatch.setattr(os.path, 'exists', racing)
+    cache.evict()
+    assert os.listdir(tmp_path) == []
+
+
+def test_failed_load_leaves_model_unchanged(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path))
+    model = CalciumModel(grid_size=16, seed=0)
+    key = cache.key(model, duration=0.01)
+    model.advance(0.01)
+    cache.store(key, model)
+
+    def vanished(path, times=None):
+        raise FileNotFoundError(path)
+    monkeypatch.setattr(os, 'utime', vanished)
+    fresh = CalciumModel(grid_size=16, seed=0)
+    assert fresh.advance_cached(0.01, cache)['cached'] is False
+    assert fresh.t == pytest.approx(0.01)
+    assert np.array_equal(fresh.calcium, model.calcium)
+
+
+def test_key_matches_checkpoint_contents(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    model = CalciumModel(grid_size=16, seed=0, refine=2)
+    model.add_ip3_global(1.0, 0.01)
+    before = cache.key(model, duration=0.01)
+    model.patches.patches.append({'rect': (0, 8, 0, 8), 'fine': np.zeros((16, 16))})
+    assert cache.key(model, duration=0.01) != before
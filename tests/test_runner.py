@@ -0,0 +1,17 @@
+import threading
+
+from calcium_model import CalciumModel
+from runner import SimulationRunner
+
+
+def test_submit_runs_on_another_thread():
+    runner = SimulationRunner(CalciumModel(grid_size=16, seed=0))
+    caller = threading.get_ident()
+    for start in (False, True):
+        if start:
+            runner.start()
+        solve = runner.submit(lambda model: (threading.get_ident(), model.t), runner.model)
+        thread, _ = solve.result(timeout=30)
+        assert thread != caller
+    runner.stop()
+    assert runner.error is None
@@ -0,0 +1,13 @@
+import numpy as np
+import pytest
+
+from calcium_model import CalciumModel
+
+
+@pytest.mark.parametrize('dtype', ['float64', 'float32'])
+def test_steady_state_converges(dtype, capsys):
+    model = CalciumModel(grid_size=64, seed=1, diffusion='implicit', dtype=dtype)
+    residual = model.steady_state()
+    assert residual < 1e7 * np.finfo(np.float64).eps
+    assert 'did not converge' not in capsys.readouterr().out
+    assert model.calcium.dtype == np.dtype(dtype)
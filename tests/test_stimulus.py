@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+import stimulus
+
+
+def delivered(stimuli, edges):
+    return sum(s.amount(t0, t1) for s in stimuli for t0, t1 in zip(edges[:-1], edges[1:]))
+
+
+@pytest.mark.parametrize('stimuli, total', [
+    ([stimulus.pulse(1.5, start=0.013, duration=0.2)], 1.5),
+    (stimulus.train(0.5, start=0.1, duration=0.05, interval=0.3, count=4), 2.0),
+    ([stimulus.ramp(2.0, start=0.05, duration=0.4)], 2.0),
+    ([stimulus.ramp(2.0, start=0.05, duration=0.4, rising=False)], 2.0),
+])
+def test_schedule_total_does_not_depend_on_steps(stimuli, total):
+    uniform = np.linspace(0, 1.5, 301)
+    uneven = np.concatenate([[0], np.cumsum(np.random.default_rng(0).uniform(1e-4, 0.03, 200))])
+    assert delivered(stimuli, uniform) == pytest.approx(total)
+    assert delivered(stimuli, uneven[uneven < 1.5].tolist() + [1.5]) == pytest.approx(total)
+
+
+def test_ramp_delivers_more_at_the_rising_end():
+    s = stimulus.ramp(1.0, start=0.0, duration=1.0)
+    assert s.amount(0.0, 0.5) == pytest.approx(0.25)
+    assert s.amount(0.5, 1.0) == pytest.approx(0.75)
@@ -0,0 +1,22 @@
+import json
+
+import sweep
+from calcium_model import CalciumModel
+
+
+def sweep_geometry_seeds(tmp_path, *options):
+    parameters = str(tmp_path / 'params.json')
+    output = str(tmp_path / 'results.jsonl')
+    CalciumModel(grid_size=16, seed=0).save_parameters(parameters)
+    sweep.main([parameters, '--sweep', 'serca_rate=0.2,0.4,0.6', '--steps', '1', '--workers', '1',
+                '-o', output, *options])
+    with open(output) as f:
+        return {json.loads(line)['geometry_seed'] for line in f}
+
+
+def test_runs_draw_their_own_geometry(tmp_path):
+    assert len(sweep_geometry_seeds(tmp_path)) == 3
+
+
+def test_geometry_seed_option_shares_one_cell(tmp_path):
+    assert sweep_geometry_seeds(tmp_path, '--geometry-seed', '7') == {7}